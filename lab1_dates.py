@@ -0,0 +1,105 @@
+from datetime import date
+from functools import lru_cache
+from typing import Callable, Optional, Sequence
+
+
+SEPARATORS = ('/', '.', '-')
+# Результат разбора для строки с разделителем, но неверной датой
+INVALID_DATE = -1
+# Номер дня в пакетном результате для отсутствующих и неверных дат
+MISSING_ORDINAL = 0
+# date.toordinal() для 1970-01-01, начало отсчета datetime64
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+DEFAULT_CACHE_SIZE = 1 << 16
+
+
+def _parse_date_uncached(value: str) -> Optional[int]:
+    """Номер дня, None без разделителя или INVALID_DATE; исключений не бросает"""
+    try:
+        # Быстрый путь: ДД?ММ?ГГГГ, разделитель на фиксированных позициях 2 и 5
+        if len(value) == 10 and value[2] == value[5] and value[2] in SEPARATORS and value.isascii():
+            day, month, year = value[0:2], value[3:5], value[6:10]
+            if day.isdigit() and month.isdigit() and year.isdigit():
+                return date(int(year), int(month), int(day)).toordinal()
+
+        # Общий путь для дат без ведущих нулей, с пробелами и т.п.
+        for separator in SEPARATORS:
+            if separator in value:
+                day, month, year = map(int, value.split(separator))
+                return date(year, month, day).toordinal()
+        return None
+    except ValueError:
+        return INVALID_DATE
+
+
+_parse_date: Callable[[str], Optional[int]] = lru_cache(maxsize=DEFAULT_CACHE_SIZE)(_parse_date_uncached)
+
+
+def set_cache_size(maxsize: int) -> None:
+    """Задает размер LRU-кэша разобранных строк дат; 0 отключает кэш"""
+    global _parse_date
+    if maxsize > 0:
+        _parse_date = lru_cache(maxsize=maxsize)(_parse_date_uncached)
+    else:
+        _parse_date = _parse_date_uncached
+
+
+def parse_date(value: str) -> Optional[int]:
+    """
+    Разбирает дату вида ДД.ММ.ГГГГ, ДД/ММ/ГГГГ или ДД-ММ-ГГГГ в номер дня.
+
+    Возвращает None, если в строке нет разделителя, и INVALID_DATE для
+    неверной даты. Повторяющиеся строки берутся из LRU-кэша.
+    """
+    return _parse_date(value)
+
+
+def date_ordinal(value: str) -> Optional[int]:
+    """Как parse_date, но для неверной даты бросает ValueError"""
+    ordinal = _parse_date(value)
+    if ordinal == INVALID_DATE:
+        raise ValueError(f"Неверный формат даты: {value}")
+    return ordinal
+
+
+def parse_dates(values: Sequence[str]):
+    """
+    Пакетно разбирает строки дат в numpy-массив int32 номеров дней.
+
+    Строки вида ДД?ММ?ГГГГ разбираются векторно, остальные - по одной
+    через parse_date. Отсутствующие и неверные даты дают MISSING_ORDINAL.
+    """
+    import numpy as np
+
+    strings = np.asarray(values, dtype=str)
+    result = np.full(len(strings), MISSING_ORDINAL, dtype=np.int32)
+    fast = np.zeros(len(strings), dtype=bool)
+
+    width = strings.dtype.itemsize // 4
+    if len(strings) and width >= 10:
+        codes = strings.view(np.uint32).reshape(len(strings), width)
+        # Беззнаковое вычитание делает символы меньше '0' очень большими числами
+        digits = codes[:, [0, 1, 3, 4, 6, 7, 8, 9]] - ord('0')
+        separator = codes[:, 2]
+        fast = ((np.char.str_len(strings) == 10) & (digits <= 9).all(axis=1)
+                & (separator == codes[:, 5]) & np.isin(separator, [ord(s) for s in SEPARATORS]))
+
+        digits = digits.astype(np.int64)
+        day = digits[:, 0] * 10 + digits[:, 1]
+        month = digits[:, 2] * 10 + digits[:, 3]
+        year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+
+        month_ok = fast & (month >= 1) & (month <= 12) & (year >= 1)
+        months = np.where(month_ok, (year - 1970) * 12 + month - 1, 0).astype('datetime64[M]')
+        month_start = months.astype('datetime64[D]')
+        days_in_month = ((months + 1).astype('datetime64[D]') - month_start).astype(np.int64)
+        valid = month_ok & (day >= 1) & (day <= days_in_month)
+
+        ordinals = month_start.astype(np.int64) + day - 1 + EPOCH_ORDINAL
+        result[valid] = ordinals[valid]
+
+    for i in np.flatnonzero(~fast):
+        ordinal = _parse_date(str(strings[i]))
+        if ordinal is not None and ordinal != INVALID_DATE:
+            result[i] = ordinal
+    return result
@@ -0,0 +1,214 @@
+import calendar
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from lab1_mmap import REQUIRED_FIELDS, find_fields, iter_record_bounds
+from lab1_dates import MISSING_ORDINAL
+from lab1_table import ordinals_to_ages, ordinals_to_ymd
+from lab1_var4 import BirthDateExtremes, Person, date_string_ordinal, parse_profile
+
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'L1BDIDX2'
+# magic, размер файла, mtime_ns, начало последней анкеты, хэш, число записей
+HEADER = struct.Struct('<8sQqQ32sQ')
+# Размер блока чтения при хэшировании содержимого
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def content_hash(file, size: int) -> bytes:
+    """Хэш первых size байт файла целиком: любая правка внутри них меняет хэш"""
+    digest = hashlib.blake2b(str(size).encode(), digest_size=32)
+    file.seek(0)
+    remaining = size
+    while remaining > 0:
+        block = file.read(min(remaining, HASH_BLOCK_SIZE))
+        if not block:
+            break
+        digest.update(block)
+        remaining -= len(block)
+    return digest.digest()
+
+
+def _years_before(day: date, years: int) -> date:
+    """Та же дата years лет назад; 29 февраля в невисокосном году становится 28-м"""
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+
+class BirthDateIndex:
+    """
+    Индекс дат рождения, хранящийся рядом с файлом анкет (<файл>.idx).
+
+    Для каждой анкеты хранится смещение в байтах и номер дня рождения.
+    Индекс привязан к размеру, mtime и хэшу содержимого файла; при
+    дописывании анкет в конец файла переиндексируется только хвост.
+    """
+
+    def __init__(self, filename: str, offsets: np.ndarray, ordinals: np.ndarray,
+                 tail_offset: int) -> None:
+        self.filename = filename
+        self.offsets = offsets
+        self.ordinals = ordinals
+        self.tail_offset = tail_offset
+
+    @staticmethod
+    def sidecar_path(filename: str) -> str:
+        return filename + INDEX_SUFFIX
+
+    @classmethod
+    def open(cls, filename: str, rebuild: bool = False) -> 'BirthDateIndex':
+        """Загружает индекс, при необходимости дополняя или перестраивая его"""
+        stat = os.stat(filename)
+        with open(filename, 'rb') as file:
+            header, index = (None, None) if rebuild else cls._load(filename)
+            if header is not None:
+                _, size, mtime_ns, _, stored_hash, _ = header
+                if size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+                    return index
+                if size < stat.st_size and content_hash(file, size) == stored_hash:
+                    # Файл только дописан (прежнее содержимое не изменилось): пересканируем
+                    # начиная с последней анкеты, она могла быть дописана не полностью
+                    index.extend_from(index.tail_offset)
+                    index.save(stat, file)
+                    return index
+
+            index = cls(filename, np.empty(0, dtype='<i8'), np.empty(0, dtype='<i4'), 0)
+            index.extend_from(0)
+            index.save(stat, file)
+            return index
+
+    @classmethod
+    def _load(cls, filename: str) -> Tuple[Optional[tuple], Optional['BirthDateIndex']]:
+        """Читает индекс с диска; (None, None), если его нет или он поврежден"""
+        try:
+            with open(cls.sidecar_path(filename), 'rb') as sidecar:
+                header = HEADER.unpack(sidecar.read(HEADER.size))
+                if header[0] != INDEX_MAGIC:
+                    return None, None
+                count = header[5]
+                offsets = np.fromfile(sidecar, dtype='<i8', count=count)
+                ordinals = np.fromfile(sidecar, dtype='<i4', count=count)
+        except (OSError, struct.error):
+            return None, None
+
+        if len(offsets) != count or len(ordinals) != count:
+            return None, None
+        return header, cls(filename, offsets, ordinals, header[3])
+
+    def save(self, stat: os.stat_result, file) -> None:
+        """Атомарно записывает индекс рядом с файлом"""
+        path = self.sidecar_path(self.filename)
+        temp_path = path + '.tmp'
+        header = HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, self.tail_offset,
+                             content_hash(file, stat.st_size), len(self.offsets))
+        with open(temp_path, 'wb') as sidecar:
+            sidecar.write(header)
+            self.offsets.astype('<i8').tofile(sidecar)
+            self.ordinals.astype('<i4').tofile(sidecar)
+        os.replace(temp_path, path)
+
+    def extend_from(self, start: int) -> None:
+        """Индексирует анкеты, начиная со смещения start (начало анкеты)"""
+        keep = self.offsets < start
+        offsets = array('q', self.offsets[keep].astype(np.int64).tobytes())
+        ordinals = array('i', self.ordinals[keep].astype(np.int32).tobytes())
+        tail_offset = start
+
+        with open(self.filename, 'rb') as file:
+            try:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                data = None
+            if data is not None:
+                with data:
+                    for record_start, record_end in iter_record_bounds(data, start, len(data)):
+                        tail_offset = record_start
+                        fields = find_fields(data, record_start, record_end)
+                        if not all(key in fields for key in REQUIRED_FIELDS):
+                            continue
+                        ordinal = date_string_ordinal(fields['дата рождения'].decode('utf-8'))
+                        offsets.append(record_start)
+                        ordinals.append(MISSING_ORDINAL if ordinal is None else ordinal)
+
+        self.offsets = np.frombuffer(offsets, dtype=np.int64)
+        self.ordinals = np.frombuffer(ordinals, dtype=np.int32)
+        self.tail_offset = tail_offset
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def read_people(self, positions: np.ndarray) -> List[Person]:
+        """Читает анкеты по номерам записей индекса, переходя сразу к их смещениям"""
+        people = []
+        with open(self.filename, 'rb') as file:
+            for position in positions:
+                file.seek(int(self.offsets[position]))
+                lines = []
+                for line in file:
+                    text = line.decode('utf-8')
+                    if not text.strip():
+                        # Пустые строки перед анкетой пропускаются, после нее - конец анкеты
+                        if lines:
+                            break
+                        continue
+                    lines.append(text)
+                people.append(parse_profile(lines))
+        return people
+
+    def extremes(self, top: int = 1) -> BirthDateExtremes:
+        """Самые старшие и самые младшие; читаются только попавшие в результат анкеты"""
+        extremes = BirthDateExtremes(top=top)
+        valid = np.flatnonzero(self.ordinals != MISSING_ORDINAL)
+        if len(valid):
+            ordinals = self.ordinals[valid]
+            k = min(top, len(valid))
+            # Порог k-го значения и все записи не хуже него, включая совпадающие даты
+            oldest_limit = np.partition(ordinals, k - 1)[k - 1]
+            youngest_limit = -np.partition(-ordinals, k - 1)[k - 1]
+            selected = valid[(ordinals <= oldest_limit) | (ordinals >= youngest_limit)]
+
+            # Добавляем в порядке файла, чтобы совпадения разрешались как при полном проходе
+            for position, person in zip(selected, self.read_people(selected)):
+                if person is not None:
+                    extremes.add(person, int(self.ordinals[position]))
+
+        extremes.count = len(self)
+        extremes.valid = len(valid)
+        return extremes
+
+    def in_age_range(self, min_age: int, max_age: int, today: Optional[date] = None) -> List[Person]:
+        """Люди, которым сейчас от min_age до max_age полных лет включительно"""
+        today = today or date.today()
+        latest = _years_before(today, min_age).toordinal()
+        earliest = _years_before(today, max_age + 1).toordinal()
+        mask = (self.ordinals > earliest) & (self.ordinals <= latest)
+        return [person for person in self.read_people(np.flatnonzero(mask)) if person is not None]
+
+    def birthdays_within(self, days: int, today: Optional[date] = None) -> List[Person]:
+        """Люди, у которых день рождения в ближайшие days дней, включая сегодня"""
+        today = today or date.today()
+        window = set()
+        for day in (today + timedelta(n) for n in range(days + 1)):
+            window.add((day.month, day.day))
+            # В невисокосный год 29 февраля отмечают 28-го
+            if (day.month, day.day) == (2, 28) and not calendar.isleap(day.year):
+                window.add((2, 29))
+
+        _, month, day = ordinals_to_ymd(self.ordinals)
+        wanted = np.array([m * 100 + d for m, d in window])
+        mask = np.isin(month * 100 + day, wanted) & (self.ordinals != MISSING_ORDINAL)
+        return [person for person in self.read_people(np.flatnonzero(mask)) if person is not None]
+
+    def ages(self, today: Optional[date] = None) -> np.ndarray:
+        """Возраст для каждой записи индекса; для невалидных дат -1"""
+        return np.where(self.ordinals != MISSING_ORDINAL, ordinals_to_ages(self.ordinals, today), -1)
@@ -0,0 +1,108 @@
+import mmap
+import re
+from typing import Dict, Iterator, Optional, Tuple
+
+from lab1_var4 import BirthDateExtremes, Person, date_string_ordinal
+
+
+# Поля, нужные для поиска крайних дат и вывода результата
+QUERY_FIELDS = ('фамилия', 'имя', 'дата рождения', 'город')
+REQUIRED_FIELDS = ('фамилия', 'имя', 'дата рождения')
+
+# Ключи в том виде, в каком их пишут выгрузки: "Дата рождения:"
+CANONICAL_KEYS = {key: key.capitalize().encode('utf-8') + b':' for key in QUERY_FIELDS}
+
+# Разделитель анкет - одна или несколько подряд пустых (или состоящих из пробелов) строк
+SEPARATOR_PATTERN = re.compile(rb'\n(?:[ \t\r]*\n)+')
+
+
+def _key_variants(key: str) -> bytes:
+    """Альтернатива регулярного выражения для ключа в разных регистрах"""
+    variants = {key, key.capitalize(), key.upper()}
+    return b'|'.join(re.escape(variant.encode('utf-8')) for variant in sorted(variants))
+
+
+# Медленный путь для анкет, где ключи записаны не в каноническом виде
+FIELD_LINE_PATTERN = re.compile(
+    rb'^[ \t]*(?P<key>' + b'|'.join(_key_variants(key) for key in QUERY_FIELDS) + rb')'
+    rb'[ \t]*:(?P<value>[^\n]*)',
+    re.MULTILINE
+)
+
+
+def find_fields(data: mmap.mmap, start: int, end: int) -> Dict[str, bytes]:
+    """Находит значения нужных полей анкеты [start, end) без декодирования остальных строк"""
+    fields = {}
+    for key, pattern in CANONICAL_KEYS.items():
+        # Как и в parse_profile, при повторе ключа берется последнее значение
+        position = data.rfind(b'\n' + pattern, start, end)
+        if position >= 0:
+            position += 1
+        elif data.find(pattern, start, start + len(pattern)) == start:
+            position = start
+        else:
+            continue
+        value_start = position + len(pattern)
+        value_end = data.find(b'\n', value_start, end)
+        fields[key] = data[value_start:end if value_end < 0 else value_end].strip()
+
+    if not all(key in fields for key in REQUIRED_FIELDS):
+        fields = {}
+        for match in FIELD_LINE_PATTERN.finditer(data, start, end):
+            fields[match.group('key').decode('utf-8').lower()] = match.group('value').strip()
+    return fields
+
+
+def _scan_record(data: mmap.mmap, start: int, end: int, extremes: BirthDateExtremes) -> None:
+    """Учитывает одну анкету; Person создается только для кандидатов в результат"""
+    fields = find_fields(data, start, end)
+    if not all(key in fields for key in REQUIRED_FIELDS):
+        return
+
+    birth_date = fields['дата рождения'].decode('utf-8')
+    ordinal = date_string_ordinal(birth_date)
+    if ordinal is None:
+        extremes.skip(valid=False)
+    elif extremes.is_candidate(ordinal):
+        person = Person(
+            last_name=fields['фамилия'].decode('utf-8'),
+            first_name=fields['имя'].decode('utf-8'),
+            gender='',
+            birth_date=birth_date,
+            contact='',
+            city=fields['город'].decode('utf-8') if 'город' in fields else ''
+        )
+        extremes.add(person, ordinal)
+    else:
+        extremes.skip()
+
+
+def iter_record_bounds(data: mmap.mmap, start: int, end: int) -> Iterator[Tuple[int, int]]:
+    """Выдает границы [начало, конец) анкет в диапазоне; start должен быть началом строки"""
+    record_start = start
+    for separator in SEPARATOR_PATTERN.finditer(data, start, end):
+        yield record_start, separator.start() + 1
+        record_start = separator.end()
+    if record_start < end:
+        yield record_start, end
+
+
+def scan_mmap(filename: str, top: int = 1, start: int = 0, end: Optional[int] = None) -> BirthDateExtremes:
+    """
+    Ищет самых старших и самых младших в отображенном в память файле.
+
+    Границы анкет и ключи ищутся по байтам, в str декодируются только
+    значения нужных полей. start должен указывать на начало строки.
+    """
+    extremes = BirthDateExtremes(top=top)
+    with open(filename, 'rb') as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Пустой файл нельзя отобразить в память
+            return extremes
+
+        with data:
+            for record_start, record_end in iter_record_bounds(data, start, len(data) if end is None else end):
+                _scan_record(data, record_start, record_end, extremes)
+    return extremes
@@ -0,0 +1,77 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, List, Tuple
+
+from lab1_mmap import scan_mmap
+from lab1_var4 import BirthDateExtremes, iter_people_from_lines
+
+
+def _is_blank(line: bytes) -> bool:
+    """Пустая строка в том же смысле, что и в iter_people_from_lines"""
+    return not line.decode('utf-8').strip()
+
+
+def _align_to_record(file: BinaryIO, offset: int, size: int) -> int:
+    """Сдвигает смещение на начало первой анкеты, начинающейся не раньше offset"""
+    if offset <= 0:
+        return 0
+    # Начинаем с начала следующей строки и ищем пустую строку-разделитель
+    file.seek(offset - 1)
+    file.readline()
+    while file.tell() < size:
+        if _is_blank(file.readline()):
+            return file.tell()
+    return size
+
+
+def split_byte_ranges(filename: str, parts: int) -> List[Tuple[int, int]]:
+    """Делит файл на диапазоны байт, границы которых совпадают с границами анкет"""
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as file:
+        bounds = [_align_to_record(file, size * i // parts, size) for i in range(parts)]
+    bounds.append(size)
+
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def _iter_range_lines(filename: str, start: int, end: int) -> Iterator[str]:
+    """Построчно читает диапазон байт [start, end) файла"""
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        position = start
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode('utf-8')
+
+
+def scan_byte_range(filename: str, start: int, end: int, top: int = 1) -> BirthDateExtremes:
+    """Частичный результат поиска крайних дат для одного диапазона файла"""
+    people = iter_people_from_lines(_iter_range_lines(filename, start, end))
+    return BirthDateExtremes(top=top).update(people)
+
+
+def find_extremes_parallel(filename: str, workers: int, top: int = 1,
+                           use_mmap: bool = False) -> BirthDateExtremes:
+    """
+    Ищет самых старших и самых младших, разбирая файл в пуле процессов.
+
+    Частичные результаты объединяются в порядке диапазонов, поэтому ответ
+    совпадает с последовательным find_oldest_and_youngest. С use_mmap
+    диапазоны сканируются по байтам через lab1_mmap.scan_mmap.
+    """
+    ranges = split_byte_ranges(filename, workers)
+    result = BirthDateExtremes(top=top)
+    if not ranges:
+        return result
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+        if use_mmap:
+            futures = [pool.submit(scan_mmap, filename, top, start, end) for start, end in ranges]
+        else:
+            futures = [pool.submit(scan_byte_range, filename, start, end, top) for start, end in ranges]
+        for future in futures:
+            result.merge(future.result())
+    return result
@@ -0,0 +1,194 @@
+import sys
+from array import array
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from lab1_dates import EPOCH_ORDINAL, MISSING_ORDINAL, parse_dates
+from lab1_var4 import Person, iter_people_from_file
+
+
+FIELDS = ('last_name', 'first_name', 'gender', 'birth_date', 'contact', 'city')
+
+
+def ordinals_to_ymd(ordinals: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Векторно раскладывает номера дней на год, месяц и день"""
+    days = (ordinals.astype(np.int64) - EPOCH_ORDINAL).astype('datetime64[D]')
+    years = days.astype('datetime64[Y]')
+    months = days.astype('datetime64[M]')
+    year = years.astype(np.int64) + 1970
+    month = (months - years).astype(np.int64) + 1
+    day = (days - months).astype(np.int64) + 1
+    return year, month, day
+
+
+def ordinals_to_ages(ordinals: np.ndarray, today: Optional[date] = None) -> np.ndarray:
+    """Векторно вычисляет полные годы для номеров дней рождения"""
+    today = today or date.today()
+    year, month, day = ordinals_to_ymd(ordinals)
+    age = today.year - year
+    # Вычитаем год, если день рождения в этом году еще не наступил
+    age -= (month * 100 + day) > (today.month * 100 + today.day)
+    return age
+
+
+class StringColumn:
+    """Строковая колонка со словарным кодированием: коды int32 и список уникальных значений"""
+
+    def __init__(self, values: Optional[List[str]] = None, codes: Optional[np.ndarray] = None) -> None:
+        self.values: List[str] = values if values is not None else []
+        self.index: Dict[str, int] = {value: code for code, value in enumerate(self.values)}
+        self.codes = codes if codes is not None else np.empty(0, dtype=np.int32)
+        self._pending = array('i')
+
+    def append(self, value: str) -> None:
+        code = self.index.get(value)
+        if code is None:
+            code = len(self.values)
+            self.index[value] = code
+            self.values.append(sys.intern(value))
+        self._pending.append(code)
+
+    def freeze(self) -> None:
+        """Переносит накопленные коды в numpy-массив"""
+        if self._pending:
+            pending = np.frombuffer(self._pending, dtype=np.int32)
+            self.codes = np.concatenate([self.codes, pending])
+            self._pending = array('i')
+
+    def take(self, selector: np.ndarray) -> 'StringColumn':
+        """Выборка строк; словарь значений разделяется с исходной колонкой"""
+        column = StringColumn.__new__(StringColumn)
+        column.values = self.values
+        column.index = self.index
+        column.codes = self.codes[selector]
+        column._pending = array('i')
+        return column
+
+    def mask(self, predicate) -> np.ndarray:
+        """Булева маска строк, значение которых удовлетворяет predicate"""
+        matching = [code for code, value in enumerate(self.values) if predicate(value)]
+        return np.isin(self.codes, np.array(matching, dtype=np.int32))
+
+    def __getitem__(self, i: int) -> str:
+        return self.values[self.codes[i]]
+
+
+def normalize_city(city: str) -> str:
+    """Приводит город к виду для сравнения: без префикса "г." и без учета регистра"""
+    city = city.strip().lower()
+    if city.startswith('г.'):
+        city = city[2:].strip()
+    return city
+
+
+def normalize_gender(gender: str) -> str:
+    """Приводит пол к первой букве: "Мужской", "М" -> "м" """
+    return gender.strip()[:1].lower()
+
+
+class PeopleTable:
+    """
+    Колоночное хранилище анкет.
+
+    Даты рождения хранятся в колонке int32 с номерами дней, строковые
+    поля - в словарно-кодированных колонках. Отдельные объекты Person
+    создаются только по запросу как представления строк.
+    """
+
+    def __init__(self) -> None:
+        self.birth_ordinal = np.empty(0, dtype=np.int32)
+        self.columns: Dict[str, StringColumn] = {field: StringColumn() for field in FIELDS}
+        # Номера дней для уникальных строк дат: каждая строка разбирается один раз
+        self._value_ordinals = np.empty(0, dtype=np.int32)
+
+    @classmethod
+    def from_people(cls, people: Iterable[Person]) -> 'PeopleTable':
+        """Строит таблицу из итерируемого источника Person"""
+        table = cls()
+        table.extend(people)
+        return table
+
+    @classmethod
+    def from_file(cls, filename: str) -> 'PeopleTable':
+        """Потоково читает файл анкет в таблицу"""
+        return cls.from_people(iter_people_from_file(filename))
+
+    def append(self, person: Person) -> None:
+        for field, column in self.columns.items():
+            column.append(getattr(person, field))
+
+    def extend(self, people: Iterable[Person]) -> None:
+        for person in people:
+            self.append(person)
+        self.freeze()
+
+    def freeze(self) -> None:
+        """Переносит накопленные строки в numpy-колонки и пакетно разбирает новые даты"""
+        for column in self.columns.values():
+            column.freeze()
+
+        dates = self.columns['birth_date']
+        parsed = len(self._value_ordinals)
+        if len(dates.values) > parsed:
+            self._value_ordinals = np.concatenate([self._value_ordinals, parse_dates(dates.values[parsed:])])
+        self.birth_ordinal = self._value_ordinals[dates.codes]
+
+    def __len__(self) -> int:
+        return len(self.birth_ordinal)
+
+    def __getitem__(self, i: int) -> Person:
+        """Представление строки i в виде Person"""
+        return Person(**{field: column[i] for field, column in self.columns.items()})
+
+    def take(self, selector: np.ndarray) -> 'PeopleTable':
+        """Новая таблица из строк по булевой маске или массиву индексов"""
+        table = PeopleTable()
+        table.birth_ordinal = self.birth_ordinal[selector]
+        table.columns = {field: column.take(selector) for field, column in self.columns.items()}
+        table._value_ordinals = self._value_ordinals
+        return table
+
+    def valid_mask(self) -> np.ndarray:
+        return self.birth_ordinal != MISSING_ORDINAL
+
+    def ages(self, today: Optional[date] = None) -> np.ndarray:
+        """Векторно вычисляет полные годы; для невалидных дат -1"""
+        return np.where(self.valid_mask(), ordinals_to_ages(self.birth_ordinal, today), -1)
+
+    def oldest_index(self) -> Optional[int]:
+        """Индекс самого старшего (первый при равных датах)"""
+        valid = self.valid_mask()
+        if not valid.any():
+            return None
+        ordinals = np.where(valid, self.birth_ordinal, np.iinfo(np.int32).max)
+        return int(np.argmin(ordinals))
+
+    def youngest_index(self) -> Optional[int]:
+        """Индекс самого младшего (последний при равных датах)"""
+        if not self.valid_mask().any():
+            return None
+        # MISSING_ORDINAL меньше любой валидной даты, поэтому маска не нужна
+        reversed_index = int(np.argmax(self.birth_ordinal[::-1]))
+        return len(self) - 1 - reversed_index
+
+    def oldest_and_youngest(self) -> Tuple[Optional[Person], Optional[Person]]:
+        """Самый старший и самый младший; для одной и той же строки возвращается один объект"""
+        oldest_i, youngest_i = self.oldest_index(), self.youngest_index()
+        if oldest_i is None:
+            return None, None
+        oldest = self[oldest_i]
+        youngest = oldest if youngest_i == oldest_i else self[youngest_i]
+        return oldest, youngest
+
+    def filter(self, city: Optional[str] = None, gender: Optional[str] = None) -> 'PeopleTable':
+        """Отбор по городу и/или полу"""
+        mask = np.ones(len(self), dtype=bool)
+        if city is not None:
+            wanted_city = normalize_city(city)
+            mask &= self.columns['city'].mask(lambda value: normalize_city(value) == wanted_city)
+        if gender is not None:
+            wanted_gender = normalize_gender(gender)
+            mask &= self.columns['gender'].mask(lambda value: normalize_gender(value) == wanted_gender)
+        return self.take(mask)
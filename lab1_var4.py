@@ -1,10 +1,28 @@
+import heapq
+import os
 import sys
 from datetime import datetime
-from typing import List, Optional, Tuple
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
 import argparse
 
+from lab1_dates import INVALID_DATE, parse_date
+from lab_metrics import METRICS, add_arguments, instrumented
+
+
+# Сколько анкет читается и разбирается за один замер стадий read и parse
+PROFILE_BLOCK = 1024
+
+
+def date_string_ordinal(value: str) -> Optional[int]:
+    """Возвращает дату как номер дня (date.toordinal) или None для невалидной даты"""
+    ordinal = parse_date(value)
+    return None if ordinal == INVALID_DATE else ordinal
+
 
 class Person:
+    __slots__ = ('last_name', 'first_name', 'gender', 'birth_date', 'contact', 'city', '_parsed_birth_date')
+
     def __init__(self, last_name: str, first_name: str, gender: str,
                  birth_date: str, contact: str, city: str) -> None:
         self.last_name = last_name
@@ -13,17 +31,21 @@ class Person:
         self.birth_date = birth_date
         self.contact = contact
         self.city = city
+        self._parsed_birth_date: Optional[Tuple[str, Optional[int]]] = None
+
+    def get_birth_date_ordinal(self) -> Optional[int]:
+        """Номер дня рождения; результат разбора кэшируется в анкете до смены birth_date"""
+        parsed = self._parsed_birth_date
+        if parsed is None or parsed[0] is not self.birth_date:
+            parsed = (self.birth_date, parse_date(self.birth_date))
+            self._parsed_birth_date = parsed
+        if parsed[1] == INVALID_DATE:
+            raise ValueError(f"Неверный формат даты: {self.birth_date}")
+        return parsed[1]
 
     def get_birth_date_object(self) -> Optional[datetime]:
-        try:
-            # Пробуем разные разделители
-            for separator in ['/', '.', '-']:
-                if separator in self.birth_date:
-                    day, month, year = map(int, self.birth_date.split(separator))
-                    return datetime(year, month, day)
-            return None
-        except (ValueError, AttributeError) as e:
-            raise ValueError(f"Неверный формат даты: {self.birth_date}") from e
+        ordinal = self.get_birth_date_ordinal()
+        return datetime.fromordinal(ordinal) if ordinal is not None else None
 
     def calculate_age(self) -> Optional[int]:
         """Вычисляет возраст"""
@@ -52,36 +74,87 @@ class Person:
             return f"{self.last_name} {self.first_name}, {self.city} (возраст не определен)"
 
 
+def parse_profile(lines: List[str]) -> Optional[Person]:
+    """Разбирает одну анкету (строки блока) в объект Person"""
+    # Ищем данные в формате "Поле: значение"
+    data = {}
+    for line in lines:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            data[key.strip().lower()] = value.strip()
+
+    # Создаем человека если есть все необходимые поля
+    if not all(field in data for field in ['фамилия', 'имя', 'дата рождения']):
+        return None
+
+    return Person(
+        last_name=data['фамилия'],
+        first_name=data['имя'],
+        gender=data.get('пол', ''),
+        birth_date=data['дата рождения'],
+        contact=data.get('номер телефона или email', ''),
+        city=data.get('город', '')
+    )
+
+
+def iter_profile_blocks(lines: Iterable[str]) -> Iterator[List[str]]:
+    """Выдает строки анкет по одной анкете из потока строк; анкеты разделены пустой строкой"""
+    block: List[str] = []
+    for line in lines:
+        if line.strip():
+            block.append(line)
+            continue
+
+        # Пустая строка завершает текущую анкету
+        if block:
+            yield block
+            block = []
+
+    if block:
+        yield block
+
+
+def iter_people_from_lines(lines: Iterable[str]) -> Iterator[Person]:
+    """Выдает анкеты по одной из потока строк; анкеты разделены пустой строкой"""
+    for block in iter_profile_blocks(lines):
+        person = parse_profile(block)
+        if person:
+            yield person
+
+
+def iter_people_from_file(filename: str) -> Iterator[Person]:
+    """Построчно читает файл и по одной выдает анкеты, разделенные пустой строкой"""
+    with open(filename, 'r', encoding='utf-8') as file:
+        yield from iter_people_from_lines(file)
+
+
+def update_from_file(extremes: 'BirthDateExtremes', filename: str,
+                     block_size: int = PROFILE_BLOCK) -> 'BirthDateExtremes':
+    """
+    Потоковый проход по файлу: анкеты читаются и разбираются блоками по
+    block_size, и чтение и разбор каждого блока замеряются отдельно
+    (стадии read и parse).
+    """
+    with open(filename, 'r', encoding='utf-8') as file:
+        blocks = iter_profile_blocks(file)
+        while True:
+            with METRICS.stage('read') as timer:
+                chunk = list(islice(blocks, block_size))
+                timer.items = len(chunk)
+                if METRICS.enabled:
+                    timer.bytes_read = sum(len(line.encode('utf-8')) for block in chunk for line in block)
+            if not chunk:
+                return extremes
+            with METRICS.stage('parse', items=len(chunk)):
+                extremes.update(person for person in map(parse_profile, chunk) if person)
+
+
 def read_people_from_file(filename: str) -> List[Person]:
     try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            content = file.read()
-
-        people = []
-        profiles = content.strip().split('\n\n')
-
-        for profile in profiles:
-            if not profile.strip():
-                continue
-
-            # Ищем данные в формате "Поле: значение"
-            data = {}
-            for line in profile.split('\n'):
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    data[key.strip().lower()] = value.strip()
-
-            # Создаем человека если есть все необходимые поля
-            if all(field in data for field in ['фамилия', 'имя', 'дата рождения']):
-                person = Person(
-                    last_name=data['фамилия'],
-                    first_name=data['имя'],
-                    gender=data.get('пол', ''),
-                    birth_date=data['дата рождения'],
-                    contact=data.get('номер телефона или email', ''),
-                    city=data.get('город', '')
-                )
-                people.append(person)
+        with METRICS.stage('read') as timer:
+            people = list(iter_people_from_file(filename))
+            timer.items = len(people)
+            timer.bytes_read = os.path.getsize(filename)
 
         if not people:
             raise ValueError(f"В файле {filename} не найдено валидных анкет")
@@ -98,32 +171,138 @@ def read_people_from_file(filename: str) -> List[Person]:
         raise Exception(f"Ошибка при чтении файла {filename}: {e}") from e
 
 
-def find_oldest_and_youngest(people: List[Person]) -> Tuple[Optional[Person], Optional[Person]]:
-    """Находит самого старого и самого молодого человека"""
-    if not people:
-        return None, None
-
+def birth_date_ordinal(person: Person) -> Optional[int]:
+    """Возвращает дату рождения как номер дня (date.toordinal) или None для невалидной даты"""
     try:
-        # Фильтруем людей с валидными датами
-        people_with_dates = []
+        return person.get_birth_date_ordinal()
+    except ValueError:
+        return None
+
+
+class BirthDateExtremes:
+    """
+    Однопроходный поиск самых старших и самых младших людей.
+
+    Дата каждой анкеты разбирается один раз. Хранятся только текущие
+    экстремумы, люди с совпадающей крайней датой и top-k кучи.
+    """
+
+    def __init__(self, top: int = 1) -> None:
+        if top < 1:
+            raise ValueError(f"Размер топа должен быть положительным: {top}")
+        self.top = top
+        self.count = 0
+        self.valid = 0
+        self.min_ordinal: Optional[int] = None
+        self.max_ordinal: Optional[int] = None
+        self.oldest_ties: List[Person] = []
+        self.youngest_ties: List[Person] = []
+        # Для старших храним (-дата, -номер), чтобы heap[0] был худшим кандидатом
+        self._oldest_heap: List[Tuple[int, int, Person]] = []
+        self._youngest_heap: List[Tuple[int, int, Person]] = []
+
+    def add(self, person: Person, ordinal: Optional[int] = None) -> None:
+        """Учитывает одного человека; ordinal можно передать, если дата уже разобрана"""
+        seq = self.count
+        self.count += 1
+        if ordinal is None:
+            ordinal = birth_date_ordinal(person)
+            if ordinal is None:
+                return
+        self.valid += 1
+
+        # При равных датах старшим считается первый в файле, младшим - последний
+        if self.min_ordinal is None or ordinal < self.min_ordinal:
+            self.min_ordinal = ordinal
+            self.oldest_ties = [person]
+        elif ordinal == self.min_ordinal:
+            self.oldest_ties.append(person)
+
+        if self.max_ordinal is None or ordinal > self.max_ordinal:
+            self.max_ordinal = ordinal
+            self.youngest_ties = [person]
+        elif ordinal == self.max_ordinal:
+            self.youngest_ties.append(person)
+
+        self._push(self._oldest_heap, (-ordinal, -seq, person))
+        self._push(self._youngest_heap, (ordinal, seq, person))
+
+    def skip(self, valid: bool = True) -> None:
+        """Учитывает анкету, которая заведомо не меняет результат (см. is_candidate)"""
+        self.count += 1
+        if valid:
+            self.valid += 1
+
+    def is_candidate(self, ordinal: int) -> bool:
+        """Может ли анкета с такой датой попасть в результат; позволяет не создавать Person"""
+        if self.min_ordinal is None or ordinal <= self.min_ordinal or ordinal >= self.max_ordinal:
+            return True
+        if len(self._oldest_heap) < self.top:
+            return True
+        # При равной дате более поздняя анкета вытесняет худшего только из младших
+        return ordinal < -self._oldest_heap[0][0] or ordinal >= self._youngest_heap[0][0]
+
+    def _push(self, heap: List[Tuple[int, int, Person]], item: Tuple[int, int, Person]) -> None:
+        """Добавляет кандидата в ограниченную кучу размера top"""
+        if len(heap) < self.top:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    def update(self, people: Iterable[Person]) -> 'BirthDateExtremes':
+        """Учитывает всех людей из итерируемого источника"""
         for person in people:
-            try:
-                if person.get_birth_date_object():
-                    people_with_dates.append(person)
-            except ValueError:
-                # Пропускаем людей с невалидными датами
-                continue
-
-        if not people_with_dates:
-            return None, None
-
-        # Сортируем по дате рождения
-        people_sorted = sorted(people_with_dates, key=lambda p: p.get_birth_date_object())
-
-        oldest = people_sorted[0]  # Первый в отсортированном списке (самый старый)
-        youngest = people_sorted[-1]  # Последный в отсортированном списке (самый молодой)
-
-        return oldest, youngest
+            self.add(person)
+        return self
+
+    def merge(self, other: 'BirthDateExtremes') -> 'BirthDateExtremes':
+        """Объединяет с результатом для анкет, идущих в файле после текущих"""
+        offset = self.count
+        for neg_ordinal, neg_seq, person in other._oldest_heap:
+            self._push(self._oldest_heap, (neg_ordinal, neg_seq - offset, person))
+        for ordinal, seq, person in other._youngest_heap:
+            self._push(self._youngest_heap, (ordinal, seq + offset, person))
+
+        if other.min_ordinal is not None:
+            if self.min_ordinal is None or other.min_ordinal < self.min_ordinal:
+                self.min_ordinal = other.min_ordinal
+                self.oldest_ties = list(other.oldest_ties)
+            elif other.min_ordinal == self.min_ordinal:
+                self.oldest_ties.extend(other.oldest_ties)
+
+        if other.max_ordinal is not None:
+            if self.max_ordinal is None or other.max_ordinal > self.max_ordinal:
+                self.max_ordinal = other.max_ordinal
+                self.youngest_ties = list(other.youngest_ties)
+            elif other.max_ordinal == self.max_ordinal:
+                self.youngest_ties.extend(other.youngest_ties)
+
+        self.count += other.count
+        self.valid += other.valid
+        return self
+
+    @property
+    def oldest(self) -> Optional[Person]:
+        return self.oldest_ties[0] if self.oldest_ties else None
+
+    @property
+    def youngest(self) -> Optional[Person]:
+        return self.youngest_ties[-1] if self.youngest_ties else None
+
+    def top_oldest(self) -> List[Person]:
+        """top самых старших, начиная с самого старшего"""
+        return [person for _, _, person in sorted(self._oldest_heap, reverse=True)]
+
+    def top_youngest(self) -> List[Person]:
+        """top самых младших, начиная с самого младшего"""
+        return [person for _, _, person in sorted(self._youngest_heap, reverse=True)]
+
+
+def find_oldest_and_youngest(people: Iterable[Person]) -> Tuple[Optional[Person], Optional[Person]]:
+    """Находит самого старого и самого молодого человека за один проход"""
+    try:
+        extremes = BirthDateExtremes().update(people)
+        return extremes.oldest, extremes.youngest
     except Exception as e:
         raise Exception("Ошибка при определении самого старого и самого молодого человека") from e
 
@@ -150,22 +329,114 @@ def print_results(oldest: Optional[Person], youngest: Optional[Person], input_fi
         print("\nНе удалось определить возраст людей.")
 
 
+def print_people(title: str, people: List[Person]) -> None:
+    """Печатает заголовок и список людей с датами рождения"""
+    print(title)
+    for person in people:
+        print(f"  {person}, {person.birth_date}")
+    print(f"Всего: {len(people)}")
+
+
+def print_top(extremes: BirthDateExtremes) -> None:
+    """Печатает top-k самых старших и самых младших и число совпадений по крайним датам"""
+    print(f"\nТоп-{extremes.top} самых старших:")
+    for i, person in enumerate(extremes.top_oldest(), 1):
+        print(f"  {i}. {person}, {person.birth_date}")
+
+    print(f"\nТоп-{extremes.top} самых младших:")
+    for i, person in enumerate(extremes.top_youngest(), 1):
+        print(f"  {i}. {person}, {person.birth_date}")
+
+    if len(extremes.oldest_ties) > 1:
+        print(f"\nС самой ранней датой рождения: {len(extremes.oldest_ties)} чел.")
+    if len(extremes.youngest_ties) > 1:
+        print(f"С самой поздней датой рождения: {len(extremes.youngest_ties)} чел.")
+
+
 def main() -> None:
     """Основная функция программы"""
     try:
         parser = argparse.ArgumentParser(description="Выгрузка пиплов")
         parser.add_argument('input_file', type=str, help="Вводные данные")
+        parser.add_argument('--top', type=int, default=1,
+                            help="Сколько самых старших и самых младших вывести")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Число процессов для параллельного разбора файла")
+        parser.add_argument('--mmap', action='store_true',
+                            help="Сканировать файл через mmap, декодируя только нужные поля")
+        parser.add_argument('--index', action='store_true',
+                            help="Использовать индекс дат рождения рядом с файлом (<файл>.idx)")
+        parser.add_argument('--age-range', type=int, nargs=2, metavar=('MIN', 'MAX'),
+                            help="Вывести людей указанного возраста (по индексу)")
+        parser.add_argument('--birthdays', type=int, metavar='DAYS',
+                            help="Вывести людей с днем рождения в ближайшие DAYS дней (по индексу)")
+        parser.add_argument('--city', type=str, help="Учитывать только людей из этого города")
+        parser.add_argument('--gender', type=str, help="Учитывать только людей этого пола (м/ж)")
+        add_arguments(parser)
 
         args = parser.parse_args()
-
-        # Чтение и обработка данных
-        people = read_people_from_file(args.input_file)
-        print(f"Найдено анкет: {len(people)}")
-
-        oldest, youngest = find_oldest_and_youngest(people)
-
-        # Вывод результатов в консоль
-        print_results(oldest, youngest, args.input_file)
+        if args.city or args.gender:
+            # Отбор по таблице выводит только одну самую старшую и самую младшую анкету
+            ignored = [name for name, used in (('--top', args.top != 1), ('--workers', args.workers > 1),
+                                               ('--mmap', args.mmap), ('--index', args.index),
+                                               ('--age-range', args.age_range),
+                                               ('--birthdays', args.birthdays is not None)) if used]
+            if ignored:
+                parser.error(f"--city/--gender не сочетаются с {', '.join(ignored)}")
+
+        with instrumented(args):
+            if args.city or args.gender:
+                # Отбор по колонкам требует таблицы, numpy загружаем только здесь
+                from lab1_table import PeopleTable
+
+                with METRICS.stage('parse') as timer:
+                    table = PeopleTable.from_file(args.input_file)
+                    timer.items = len(table)
+                selected = table.filter(city=args.city, gender=args.gender)
+                print(f"Найдено анкет: {len(table)}, после отбора: {len(selected)}")
+                oldest, youngest = selected.oldest_and_youngest()
+                print_results(oldest, youngest, args.input_file)
+                return
+
+            if args.index or args.age_range or args.birthdays is not None or args.workers > 1 or args.mmap:
+                # Индекс, процессы и mmap замеряются целиком как одна стадия parse
+                with METRICS.stage('parse') as timer:
+                    if args.index or args.age_range or args.birthdays is not None:
+                        from lab1_index import BirthDateIndex
+
+                        index = BirthDateIndex.open(args.input_file)
+                        if args.age_range:
+                            min_age, max_age = args.age_range
+                            print_people(f"Возраст от {min_age} до {max_age} лет:",
+                                         index.in_age_range(min_age, max_age))
+                            return
+                        if args.birthdays is not None:
+                            print_people(f"Дни рождения в ближайшие {args.birthdays} дн.:",
+                                         index.birthdays_within(args.birthdays))
+                            return
+                        extremes = index.extremes(top=args.top)
+                    elif args.workers > 1:
+                        from lab1_parallel import find_extremes_parallel
+
+                        extremes = find_extremes_parallel(args.input_file, args.workers, top=args.top,
+                                                          use_mmap=args.mmap)
+                    else:
+                        from lab1_mmap import scan_mmap
+
+                        extremes = scan_mmap(args.input_file, top=args.top)
+                    timer.items = extremes.count
+                    timer.bytes_read = os.path.getsize(args.input_file)
+            else:
+                # Потоковое чтение и поиск крайних дат за один проход; стадии read и parse - по блокам анкет
+                extremes = update_from_file(BirthDateExtremes(top=args.top), args.input_file)
+            if not extremes.count:
+                raise ValueError(f"В файле {args.input_file} не найдено валидных анкет")
+            print(f"Найдено анкет: {extremes.count}")
+
+            # Вывод результатов в консоль
+            print_results(extremes.oldest, extremes.youngest, args.input_file)
+            if args.top > 1:
+                print_top(extremes)
 
     except FileNotFoundError as e:
         print(f"Ошибка: {e}")
@@ -0,0 +1,218 @@
+import hashlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from icrawler import ImageDownloader
+from requests.adapters import HTTPAdapter
+
+from lab2_manifest import Manifest, file_sha256
+from lab_metrics import METRICS
+
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
+# Коды ответа, после которых имеет смысл повторить запрос
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+CHUNK_SIZE = 1 << 16
+# Как часто сохранять манифест во время загрузки, чтобы не потерять его при сбое
+MANIFEST_SAVE_EVERY = 50
+
+
+class UrlCollector(ImageDownloader):
+    """Загрузчик icrawler, который только запоминает найденные ссылки, ничего не скачивая"""
+
+    def __init__(self, thread_num, signal, session, storage):
+        super().__init__(thread_num, signal, session, storage)
+        self.urls = []
+
+    def download(self, task, default_ext, timeout=5, max_retry=3, overwrite=False, **kwargs):
+        with self.lock:
+            if self.reach_max_num():
+                self.signal.set(reach_max_num=True)
+                return
+            self.fetched_num += 1
+            self.urls.append(task['file_url'])
+
+
+def collect_image_urls(crawler_cls, folder: str, keyword: str, count: int, **crawler_kwargs) -> List[str]:
+    """Ищет ссылки на изображения поисковым краулером icrawler"""
+    crawler = crawler_cls(
+        downloader_cls=UrlCollector,
+        storage={'root_dir': folder},
+        **crawler_kwargs
+    )
+    crawler.crawl(keyword=keyword, max_num=count)
+    return crawler.downloader.urls
+
+
+def partial_path(folder: str, url: str) -> str:
+    """Путь недокачанного файла; зависит только от ссылки, чтобы найти его при повторном запуске"""
+    return os.path.join(folder, f".{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}.part")
+
+
+def url_extension(url: str, default: str = 'jpg') -> str:
+    """Расширение файла из пути ссылки, если оно похоже на расширение изображения"""
+    path = urlparse(url).path
+    extension = path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+    return extension if extension in IMAGE_EXTENSIONS else default
+
+
+class DownloadEngine:
+    """
+    Многопоточная загрузка файлов по списку ссылок.
+
+    У каждого потока своя requests.Session с пулом keep-alive соединений,
+    поэтому соединения к одному хосту переиспользуются между файлами.
+    Сетевые ошибки и ответы 429/5xx повторяются с экспоненциальной
+    задержкой и случайным разбросом.
+    """
+
+    def __init__(self, workers: int = 8, retries: int = 3, backoff: float = 0.5,
+                 timeout: float = 10, min_size: Optional[Tuple[int, int]] = None) -> None:
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.min_size = min_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.downloaded = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.requested = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.manifest: Optional[Manifest] = None
+
+    def _session(self) -> requests.Session:
+        """Сессия текущего потока"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def fetch_to_file(self, url: str, part_path: str) -> bool:
+        """
+        Скачивает ссылку в файл part_path с повторами.
+
+        Если файл уже есть после прерванной загрузки, докачивает его
+        запросом Range; сервер без поддержки Range отдаст файл целиком.
+        """
+        for attempt in range(self.retries + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            try:
+                with self._session().get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    if offset and response.status_code == 416:
+                        # Запрошенный диапазон пуст: файл уже докачан
+                        return True
+                    if response.status_code in (200, 206):
+                        mode = 'ab' if response.status_code == 206 else 'wb'
+                        with open(part_path, mode) as f:
+                            for chunk in response.iter_content(CHUNK_SIZE):
+                                f.write(chunk)
+                        return True
+                    if response.status_code not in RETRY_STATUSES:
+                        return False
+            except requests.RequestException:
+                pass
+
+            if attempt < self.retries:
+                time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+        return False
+
+    def _is_large_enough(self, path: str) -> bool:
+        """Проверка минимального размера изображения, как min_size в icrawler"""
+        if self.min_size is None:
+            return True
+        from PIL import Image
+
+        try:
+            with Image.open(path) as img:
+                width, height = img.size
+        except Exception:
+            return False
+        return width >= self.min_size[0] and height >= self.min_size[1]
+
+    def _download_one(self, job: Tuple[str, str]) -> Optional[str]:
+        """Скачивает одну ссылку; ошибка файловой системы считается неудачной загрузкой"""
+        try:
+            return self._fetch_job(job)
+        except OSError as e:
+            print(f"Не удалось сохранить {job[0]}: {e}")
+            with self._lock:
+                self.failed += 1
+            return None
+
+    def _fetch_job(self, job: Tuple[str, str]) -> Optional[str]:
+        url, path = job
+        part_path = partial_path(os.path.dirname(path), url)
+        # Недокачанный файл остается на диске для докачки при следующем запуске
+        with METRICS.stage('download') as timer:
+            fetched = self.fetch_to_file(url, part_path)
+            if fetched and METRICS.enabled:
+                timer.bytes_written = os.path.getsize(part_path)
+        if fetched and not self._is_large_enough(part_path):
+            os.remove(part_path)
+            fetched = False
+        if not fetched:
+            with self._lock:
+                self.failed += 1
+            return None
+
+        size = os.path.getsize(part_path)
+        os.replace(part_path, path)
+        sha256 = file_sha256(path) if self.manifest is not None else None
+        with self._lock:
+            self.downloaded += 1
+            self.bytes += size
+            if self.manifest is not None:
+                if self.manifest.record(os.path.basename(path), url, sha256) is not None:
+                    self.duplicates += 1
+                    path = None
+                if self.downloaded % MANIFEST_SAVE_EVERY == 0:
+                    self.manifest.save()
+        return path
+
+    def download_all(self, urls: List[str], folder: str, start_index: int = 1,
+                     manifest: Optional[Manifest] = None) -> List[str]:
+        """
+        Скачивает ссылки в папку (имена 000001.jpg, ...); возвращает пути в порядке ссылок.
+
+        С манифестом уже скачанные ссылки пропускаются, нумерация
+        продолжается после существующих файлов, а побайтовые дубликаты
+        удаляются сразу после загрузки.
+        """
+        self.manifest = manifest
+        # Повторы ссылки писали бы в один и тот же .part файл из разных потоков
+        urls = list(dict.fromkeys(urls))
+        if manifest is not None:
+            urls = [url for url in urls if not manifest.is_downloaded(url)]
+            start_index = max(start_index, manifest.next_index())
+
+        jobs = [
+            (url, os.path.join(folder, f"{start_index + i:06d}.{url_extension(url)}"))
+            for i, url in enumerate(urls)
+        ]
+        self.requested += len(jobs)
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                paths = list(pool.map(self._download_one, jobs))
+        finally:
+            self.elapsed += time.perf_counter() - start
+            if manifest is not None:
+                manifest.save()
+        return [path for path in paths if path is not None]
+
+    def images_per_second(self) -> float:
+        return self.downloaded / self.elapsed if self.elapsed else 0.0
@@ -0,0 +1,142 @@
+import csv
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+MANIFEST_NAME = '.manifest.csv'
+FIELDS = ['filename', 'url', 'size', 'mtime_ns', 'sha256', 'duplicate_of']
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 содержимого файла, читая его блоками"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Манифест папки с изображениями: источник, размер и хэш каждого файла.
+
+    Хранится в папке в файле .manifest.csv. По нему повторный запуск
+    пропускает уже скачанные ссылки, не пересчитывает хэши неизмененных
+    файлов и отбрасывает побайтовые дубликаты.
+    """
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.entries: Dict[str, dict] = {}
+        self.by_url: Dict[str, str] = {}
+        self.by_hash: Dict[str, str] = {}
+
+    @classmethod
+    def load(cls, folder: str) -> 'Manifest':
+        manifest = cls(folder)
+        if os.path.exists(manifest.path):
+            with open(manifest.path, 'r', newline='', encoding='utf-8') as f:
+                for entry in csv.DictReader(f):
+                    manifest._add(entry)
+        return manifest
+
+    def save(self) -> None:
+        """Атомарно записывает манифест"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(self.entries.values())
+        os.replace(temp_path, self.path)
+
+    def _add(self, entry: dict) -> None:
+        filename = entry['filename']
+        self.entries[filename] = entry
+        if entry['url']:
+            self.by_url[entry['url']] = filename
+        if not entry['duplicate_of']:
+            self.by_hash.setdefault(entry['sha256'], filename)
+
+    def is_downloaded(self, url: str) -> bool:
+        """Была ли ссылка уже скачана (или отброшена как дубликат)"""
+        filename = self.by_url.get(url)
+        if filename is None:
+            return False
+        entry = self.entries[filename]
+        return os.path.exists(os.path.join(self.folder, entry['duplicate_of'] or filename))
+
+    def record(self, filename: str, url: str = '', sha256: Optional[str] = None) -> Optional[str]:
+        """
+        Заносит файл папки в манифест.
+
+        Если такое же содержимое уже есть под другим именем, файл удаляется
+        и возвращается имя оригинала.
+        """
+        path = os.path.join(self.folder, filename)
+        stat = os.stat(path)
+        old = self.entries.get(filename)
+        if old and not url:
+            url = old['url']
+        if sha256 is None:
+            unchanged = old and int(old['size']) == stat.st_size and int(old['mtime_ns']) == stat.st_mtime_ns
+            sha256 = old['sha256'] if unchanged else file_sha256(path)
+
+        original = self.by_hash.get(sha256)
+        if original is not None and not os.path.exists(os.path.join(self.folder, original)):
+            # Оригинал удален с диска: этот файл становится новым оригиналом
+            original = None
+        duplicate_of = original if original is not None and original != filename else ''
+        if not duplicate_of:
+            self.by_hash[sha256] = filename
+        self._add({
+            'filename': filename,
+            'url': url,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': sha256,
+            'duplicate_of': duplicate_of,
+        })
+        if duplicate_of:
+            os.remove(path)
+            return duplicate_of
+        return None
+
+    def refresh(self, paths: List[Path]) -> List[Path]:
+        """
+        Учитывает все файлы папки и возвращает только уникальные.
+
+        Файлы, уже бывшие в манифесте, обрабатываются первыми, поэтому
+        оригиналом дубликата остается ранее записанный файл. Записи об
+        удаленных файлах (и о дубликатах удаленных оригиналов) забываются,
+        чтобы их ссылки скачались заново.
+        """
+        self._forget_missing()
+        known = [path for path in paths if path.name in self.entries]
+        new = sorted(path for path in paths if path.name not in self.entries)
+        unique = set()
+        for path in known + new:
+            if self.record(path.name) is None:
+                unique.add(path.name)
+        self.save()
+        return [path for path in paths if path.name in unique]
+
+    def _forget_missing(self) -> None:
+        """Удаляет записи, чей файл (или файл оригинала для дубликата) отсутствует в папке"""
+        missing = [
+            filename for filename, entry in self.entries.items()
+            if not os.path.exists(os.path.join(self.folder, entry['duplicate_of'] or filename))
+        ]
+        for filename in missing:
+            entry = self.entries.pop(filename)
+            if self.by_url.get(entry['url']) == filename:
+                del self.by_url[entry['url']]
+            if self.by_hash.get(entry['sha256']) == filename:
+                del self.by_hash[entry['sha256']]
+
+    def next_index(self) -> int:
+        """Следующий свободный номер для файлов вида 000001.jpg"""
+        numbers = [int(Path(name).stem) for name in os.listdir(self.folder) if Path(name).stem.isdigit()]
+        return max(numbers, default=0) + 1
@@ -0,0 +1,168 @@
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from lab4_dimensions import DEFAULT_WORKERS, HEADER_BYTES, HEADER_PARSERS, map_paths
+from lab_metrics import METRICS
+
+
+# Сколько байт конца файла читается для проверки, что файл не обрезан
+TAIL_BYTES = 1024
+# Сторона уменьшенного изображения для разностного хэша: HASH_SIZE * HASH_SIZE бит
+HASH_SIZE = 8
+# Наибольшее расстояние Хэмминга между хэшами почти одинаковых изображений
+DEFAULT_MAX_DISTANCE = 5
+# Хэш, где единиц или нулей меньше этого числа, почти не несет информации (однотонное
+# или плавное изображение): такие изображения не сравниваются на похожесть
+MIN_HASH_BITS = 8
+
+
+def check_integrity(path: str) -> str:
+    """
+    Формат файла по сигнатуре и проверка, что файл не обрезан: маркер
+    конца JPEG, чанк IEND PNG, завершающий байт GIF или размер из
+    заголовка BMP и WebP. Для испорченного файла бросает ValueError.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        header = file.read(HEADER_BYTES)
+        file.seek(max(0, size - TAIL_BYTES))
+        tail = file.read()
+
+    if header[:2] == b'\xff\xd8':
+        # После маркера конца бывают нули или метаданные, поэтому ищется весь хвост
+        if b'\xff\xd9' not in tail:
+            raise ValueError("JPEG обрезан: нет маркера конца изображения")
+        return 'JPEG'
+    image_format = next((name for name, parser in HEADER_PARSERS.items() if parser(header) is not None), None)
+    if image_format == 'PNG' and b'IEND' not in tail:
+        raise ValueError("PNG обрезан: нет чанка IEND")
+    if image_format == 'GIF' and not tail.rstrip(b'\x00').endswith(b';'):
+        raise ValueError("GIF обрезан: нет завершающего байта")
+    if image_format == 'BMP' and size < int.from_bytes(header[2:6], 'little'):
+        raise ValueError("BMP обрезан: файл меньше размера из заголовка")
+    if image_format == 'WEBP' and size < int.from_bytes(header[4:8], 'little') + 8:
+        raise ValueError("WebP обрезан: файл меньше размера из заголовка RIFF")
+    if image_format is None:
+        from PIL import Image
+
+        # Остальные форматы (TIFF и т.п.) распознает PIL, иначе это не изображение
+        with Image.open(path) as img:
+            image_format = img.format
+    return image_format
+
+
+def difference_hash(path: str, hash_size: int = HASH_SIZE) -> int:
+    """
+    Разностный хэш (dHash): изображение уменьшается до (hash_size + 1) x
+    hash_size в оттенках серого, каждый бит - ярче ли пиксель соседа справа.
+    У почти одинаковых изображений хэши отличаются в нескольких битах.
+    Уменьшение идет в дробных яркостях: при округлении до 8 бит соседние
+    пиксели малоконтрастных изображений часто равны, и хэш почти весь из нулей.
+    """
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(path) as img:
+        # JPEG сразу декодируется в уменьшенном масштабе
+        img.draft('L', (hash_size * 8, hash_size * 8))
+        small = img.convert('L').convert('F').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def is_informative(value: int, bits: int = HASH_SIZE * HASH_SIZE) -> bool:
+    """Достаточно ли в хэше и единиц, и нулей, чтобы сравнивать его с другими"""
+    ones = value.bit_count()
+    return MIN_HASH_BITS <= ones <= bits - MIN_HASH_BITS
+
+
+def inspect_image(path: str) -> Tuple[str, int]:
+    """Формат и разностный хэш файла, прошедшего проверку целостности"""
+    with METRICS.stage('validate') as timer:
+        image_format = check_integrity(path)
+        value = difference_hash(path)
+        if METRICS.enabled:
+            # Для хэша файл декодируется целиком
+            timer.bytes_read = os.path.getsize(path)
+        return image_format, value
+
+
+class BKTree:
+    """
+    BK-дерево хэшей по расстоянию Хэмминга.
+
+    Поиск всех хэшей не дальше max_distance обходит только поддеревья с
+    расстоянием до узла в [d - max_distance, d + max_distance], поэтому
+    поиск дубликатов не сравнивает каждую пару изображений.
+    """
+
+    def __init__(self) -> None:
+        self.root: Optional[list] = None
+        self.size = 0
+
+    def add(self, value: int, item: Any) -> None:
+        self.size += 1
+        node = [value, item, {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = (value ^ current[0]).bit_count()
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """Пары (расстояние, элемент) для хэшей не дальше max_distance, по возрастанию расстояния"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = (value ^ node[0]).bit_count()
+            if distance <= max_distance:
+                found.append((distance, node[1]))
+            children: Dict[int, list] = node[2]
+            for edge in range(distance - max_distance, distance + max_distance + 1):
+                child = children.get(edge)
+                if child is not None:
+                    stack.append(child)
+        return sorted(found, key=lambda pair: pair[0])
+
+
+def validate_images(paths: Sequence, workers: int = DEFAULT_WORKERS, max_distance: int = DEFAULT_MAX_DISTANCE,
+                    on_error: Optional[Callable[[Any, Exception], None]] = None) -> Tuple[list, list, list]:
+    """
+    Проверяет изображения в пуле потоков и отбрасывает испорченные файлы и
+    почти одинаковые изображения (расстояние хэшей не больше max_distance).
+    Изображения с малоинформативным хэшем (см. is_informative) не
+    сравниваются и всегда остаются.
+
+    Возвращает (годные пути, испорченные пути, [(дубликат, оригинал), ...])
+    в порядке paths; оригиналом считается первый из похожих файлов.
+    Причина отказа для испорченного файла передается в on_error(путь, исключение).
+    """
+    errors: Dict[str, Exception] = {}
+    results = map_paths(inspect_image, [str(path) for path in paths], workers,
+                        on_error=lambda path, e: errors.__setitem__(path, e))
+    valid, bad, duplicates = [], [], []
+    tree = BKTree()
+    for path, result in zip(paths, results):
+        if result is None:
+            bad.append(path)
+            if on_error is not None:
+                on_error(path, errors[str(path)])
+            continue
+        if not is_informative(result[1]):
+            valid.append(path)
+            continue
+        matches = tree.search(result[1], max_distance)
+        if matches:
+            duplicates.append((path, matches[0][1]))
+            continue
+        tree.add(result[1], path)
+        valid.append(path)
+    return valid, bad, duplicates
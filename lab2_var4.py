@@ -1,46 +1,201 @@
 import csv
+import io
 import os
+import random
 import argparse
-from icrawler.builtin import GoogleImageCrawler, BingImageCrawler
+from array import array
+from itertools import islice
 from pathlib import Path
 
+from lab2_manifest import Manifest
+from lab_metrics import METRICS, add_arguments, instrumented
+
+
+SEARCH_KEYWORD = 'monochrome dog portrait'
+
 
 class ImageIterator:
-    def __init__(self, csv_file):
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)
-            self.paths = [row[0] for row in reader]
+    """
+    Итератор по путям из CSV аннотации.
+
+    Без перемешивания и перехода по индексу строки читаются потоково, в
+    памяти держится одна строка. Для len(), доступа по индексу, seek() и
+    перемешивания один раз строится индекс смещений строк в файле
+    (8 байт на строку), а сами пути читаются с диска по требованию.
+    shard/num_shards делят строки между процессами без пересечений.
+    """
+
+    def __init__(self, csv_file, shuffle=False, seed=0, shard=0, num_shards=1):
+        if not 0 <= shard < num_shards:
+            raise ValueError(f"Неверный номер части: {shard} из {num_shards}")
+        self.csv_file = csv_file
+        self.shuffle = shuffle
+        self.seed = seed
+        self.shard = shard
+        self.num_shards = num_shards
         self.index = 0
+        self._streaming = not shuffle
+        self._stream = None
+        self._offsets = None
+        self._order = None
+        self._file = None
+
+    def _build_index(self):
+        """Находит смещения начала строк данных (без заголовка и пустых строк)"""
+        offsets = array('q')
+        with open(self.csv_file, 'rb') as f:
+            offset = row_start = 0
+            in_quotes = False
+            is_header = True
+            for line in f:
+                if not in_quotes:
+                    row_start = offset
+                offset += len(line)
+                # Перевод строки внутри кавычек не заканчивает запись CSV
+                if line.count(b'"') % 2:
+                    in_quotes = not in_quotes
+                if in_quotes:
+                    continue
+                if is_header:
+                    is_header = False
+                elif offset - row_start > len(line) or line.strip(b'\r\n'):
+                    offsets.append(row_start)
+        self._offsets = offsets
+
+        if self.shuffle:
+            order = array('q', range(len(offsets)))
+            random.Random(self.seed).shuffle(order)
+            self._order = order[self.shard::self.num_shards]
+
+    def _ensure_index(self):
+        if self._offsets is None:
+            self._build_index()
+
+    def _iter_stream(self):
+        """Потоковое чтение путей своей части без построения индекса"""
+        with open(self.csv_file, 'r', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            rows = (row for row in reader if row)
+            for row in islice(rows, self.shard, None, self.num_shards):
+                yield row[0]
+
+    def _read_path(self, row_number):
+        """Читает путь из строки с заданным номером, переходя к ее смещению"""
+        if self._file is None:
+            self._file = open(self.csv_file, 'rb')
+        self._file.seek(self._offsets[row_number])
+        lines = []
+        in_quotes = False
+        for line in self._file:
+            lines.append(line)
+            if line.count(b'"') % 2:
+                in_quotes = not in_quotes
+            if not in_quotes:
+                break
+        text = b''.join(lines).decode('utf-8')
+        return next(csv.reader(io.StringIO(text, newline='')))[0]
+
+    def __len__(self):
+        self._ensure_index()
+        if self._order is not None:
+            return len(self._order)
+        return len(range(self.shard, len(self._offsets), self.num_shards))
+
+    def __getitem__(self, position):
+        length = len(self)
+        if position < 0:
+            position += length
+        if not 0 <= position < length:
+            raise IndexError(f"Индекс {position} вне диапазона 0..{length - 1}")
+        if self._order is not None:
+            return self._read_path(self._order[position])
+        return self._read_path(self.shard + position * self.num_shards)
+
+    def seek(self, position):
+        """Переходит к позиции position; seek(0) начинает обход заново"""
+        self.index = position
+        self._stream = None
+        if position != 0:
+            self._streaming = False
+
+    def reset(self):
+        self.seek(0)
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self.index < len(self.paths):
-            path = self.paths[self.index]
+        if self._streaming:
+            if self._stream is None:
+                self._stream = self._iter_stream()
+            path = next(self._stream)
+            self.index += 1
+            return path
+
+        if self.index < len(self):
+            path = self[self.index]
             self.index += 1
             return path
         raise StopIteration
 
+    def batches(self, batch_size):
+        """Выдает оставшиеся пути списками по batch_size штук"""
+        while True:
+            batch = list(islice(self, batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
-def download_images(folder, count):
+    def __getstate__(self):
+        # Открытые файлы и генераторы не передаются в другие процессы
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_stream'] = None
+        if self._streaming and self.index:
+            state['_streaming'] = False
+        return state
+
+
+def folder_is_empty(folder):
+    """Нет ли в папке файлов, кроме служебных (начинающихся с точки)"""
+    return not any(not name.startswith('.') for name in os.listdir(folder))
+
+
+def download_images(folder, count, incremental=False):
     """Скачивает изображения, пробует разные методы"""
+    from icrawler.builtin import GoogleImageCrawler, BingImageCrawler
+
+    # В инкрементальном режиме нумерация продолжается после уже скачанных файлов
+    file_idx_offset = 'auto' if incremental else 0
 
     # Пробуем Bing - он обычно стабильнее
     try:
         print("Пробую Bing...")
         bing_crawler = BingImageCrawler(storage={'root_dir': folder})
         bing_crawler.crawl(
-            keyword='monochrome dog portrait',
+            keyword=SEARCH_KEYWORD,
             max_num=count,
-            min_size=(100, 100)
+            min_size=(100, 100),
+            file_idx_offset=file_idx_offset
         )
     except Exception as e:
         print(f"Bing не сработал: {e}")
 
     # Если папка пустая, пробуем Google
-    if len(os.listdir(folder)) == 0:
+    if folder_is_empty(folder):
         try:
             print("Пробую Google...")
             google_crawler = GoogleImageCrawler(
@@ -50,62 +205,163 @@ def download_images(folder, count):
                 downloader_threads=2
             )
             google_crawler.crawl(
-                keyword='monochrome dog portrait',
+                keyword=SEARCH_KEYWORD,
                 max_num=count,
-                min_size=(100, 100)
+                min_size=(100, 100),
+                file_idx_offset=file_idx_offset
             )
         except Exception as e:
             print(f"Google не сработал: {e}")
 
     # Если все равно пусто, создаем тестовые файлы
-    if len(os.listdir(folder)) == 0:
-        print("Создаю тестовые файлы...")
-        for i in range(min(count, 10)):
-            with open(os.path.join(folder, f"dog_{i + 1}.jpg"), 'wb') as f:
-                f.write(b'test')  # Пустой файл
-        print(f"Создано {min(count, 10)} тестовых файлов")
+    if folder_is_empty(folder):
+        create_test_files(folder, count)
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Скачать ч/б фото собак')
-    parser.add_argument('--folder', required=True, help='Папка для сохранения')
-    parser.add_argument('--csv', required=True, help='CSV файл аннотации')
-    parser.add_argument('--count', type=int, default=50, help='Количество фото')
+def create_test_files(folder, count):
+    """Создает файлы-заглушки, если скачать ничего не удалось"""
+    print("Создаю тестовые файлы...")
+    for i in range(min(count, 10)):
+        with open(os.path.join(folder, f"dog_{i + 1}.jpg"), 'wb') as f:
+            f.write(b'test')  # Пустой файл
+    print(f"Создано {min(count, 10)} тестовых файлов")
 
-    args = parser.parse_args()
 
-    # Создаем папку
-    os.makedirs(args.folder, exist_ok=True)
+def download_images_pooled(folder, count, workers, urls=None, manifest=None):
+    """Скачивает изображения пулом потоков; ссылки ищет краулером, если не заданы"""
+    from lab2_downloader import DownloadEngine, collect_image_urls
+
+    min_size = None
+    if urls is None:
+        from icrawler.builtin import GoogleImageCrawler, BingImageCrawler
+
+        urls = []
+        min_size = (100, 100)
+        for name, crawler_cls in [('Bing', BingImageCrawler), ('Google', GoogleImageCrawler)]:
+            try:
+                print(f"Ищу ссылки через {name}...")
+                urls = collect_image_urls(crawler_cls, folder, SEARCH_KEYWORD, count)
+            except Exception as e:
+                print(f"{name} не сработал: {e}")
+            if urls:
+                break
+
+    engine = DownloadEngine(workers=workers, min_size=min_size)
+    engine.download_all(urls[:count], folder, manifest=manifest)
+    print(f"Скачано {engine.downloaded} из {engine.requested} ссылок "
+          f"за {engine.elapsed:.2f} с ({engine.images_per_second():.1f} изобр./с)")
+    if engine.duplicates:
+        print(f"Удалено дубликатов при скачивании: {engine.duplicates}")
+
+    if folder_is_empty(folder):
+        create_test_files(folder, count)
 
-    print(f"Начинаю скачивание {args.count} фото...")
-    download_images(args.folder, args.count)
 
-    # Проверяем что скачалось
+def find_image_files(folder):
+    """Файлы изображений папки, которые попадают в аннотацию"""
     image_files = []
     for ext in ['.jpg', '.jpeg', '.png', '.gif']:
-        image_files.extend(Path(args.folder).glob(f'*{ext}'))
+        image_files.extend(Path(folder).glob(f'*{ext}'))
+    return image_files
 
-    print(f"Скачано файлов: {len(image_files)}")
 
-    # Создаем CSV
-    print(f"Создаю аннотацию {args.csv}...")
-    with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+def validate_files(image_files, max_distance):
+    """Отбрасывает испорченные файлы и почти одинаковые изображения до записи аннотации"""
+    from lab2_validate import validate_images
+
+    print("Проверяю файлы...")
+    valid, bad, duplicates = validate_images(
+        image_files, max_distance=max_distance,
+        on_error=lambda path, e: print(f"  Испорченный файл {path}: {e}")
+    )
+    for path, original in duplicates:
+        print(f"  {path} почти совпадает с {original}")
+    print(f"Отброшено испорченных: {len(bad)}, похожих: {len(duplicates)}")
+    return valid
+
+
+def write_annotation(csv_file, image_files, append=False):
+    """Записывает CSV аннотации; при append дописывает только новые пути"""
+    known = set()
+    if append and os.path.exists(csv_file):
+        with open(csv_file, 'r', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            known = {row[0] for row in reader if row}
+
+    mode = 'a' if known else 'w'
+    with open(csv_file, mode, newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
-        writer.writerow(['Абсолютный путь', 'Относительный путь'])
+        if not known:
+            writer.writerow(['Абсолютный путь', 'Относительный путь'])
 
         for img_path in image_files:
             abs_path = str(img_path.absolute())
             rel_path = str(img_path)
-            writer.writerow([abs_path, rel_path])
-
-    # Тест итератора
-    if len(image_files) > 0:
-        print("\nТест итератора (первые 5 путей):")
-        iterator = ImageIterator(args.csv)
-        for i in range(min(5, len(image_files))):
-            print(f"  {next(iterator)}")
-    else:
-        print("Нет изображений для создания итератора")
+            if abs_path not in known:
+                writer.writerow([abs_path, rel_path])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Скачать ч/б фото собак')
+    parser.add_argument('--folder', required=True, help='Папка для сохранения')
+    parser.add_argument('--csv', required=True, help='CSV файл аннотации')
+    parser.add_argument('--count', type=int, default=50, help='Количество фото')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Скачивать пулом из N потоков (0 - штатный загрузчик icrawler)')
+    parser.add_argument('--urls', help='Файл со ссылками (по одной в строке) вместо поиска')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Докачивать по манифесту папки, пропуская уже скачанное и дубликаты')
+    parser.add_argument('--no-validate', action='store_true',
+                        help='Не проверять файлы перед записью аннотации')
+    parser.add_argument('--max-distance', type=int, default=5,
+                        help='Расстояние хэшей, до которого изображения считаются почти одинаковыми')
+    add_arguments(parser)
+
+    args = parser.parse_args()
+
+    with instrumented(args):
+        # Создаем папку
+        os.makedirs(args.folder, exist_ok=True)
+        manifest = Manifest.load(args.folder) if args.incremental else None
+
+        print(f"Начинаю скачивание {args.count} фото...")
+        if args.workers > 0 or args.urls:
+            urls = None
+            if args.urls:
+                with open(args.urls, 'r', encoding='utf-8') as f:
+                    urls = [line.strip() for line in f if line.strip()]
+            download_images_pooled(args.folder, args.count, max(args.workers, 1), urls, manifest)
+        else:
+            with METRICS.stage('download'):
+                download_images(args.folder, args.count, args.incremental)
+
+        # Проверяем что скачалось
+        image_files = find_image_files(args.folder)
+
+        print(f"Скачано файлов: {len(image_files)}")
+
+        if manifest is not None:
+            found = len(image_files)
+            image_files = manifest.refresh(image_files)
+            print(f"Отброшено дубликатов: {found - len(image_files)}")
+
+        if not args.no_validate:
+            image_files = validate_files(image_files, args.max_distance)
+
+        # Создаем CSV
+        print(f"Создаю аннотацию {args.csv}...")
+        with METRICS.stage('write', items=len(image_files)):
+            write_annotation(args.csv, image_files, append=args.incremental)
+
+        # Тест итератора
+        if len(image_files) > 0:
+            print("\nТест итератора (первые 5 путей):")
+            iterator = ImageIterator(args.csv)
+            for i in range(min(5, len(image_files))):
+                print(f"  {next(iterator)}")
+        else:
+            print("Нет изображений для создания итератора")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
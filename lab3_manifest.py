@@ -0,0 +1,66 @@
+import csv
+import os
+from typing import Dict
+
+
+MANIFEST_NAME = '.rotation_manifest.csv'
+FIELDS = ['output', 'source', 'size', 'mtime_ns', 'angle']
+
+
+class RotationManifest:
+    """
+    Манифест выходной папки поворота: из какого файла, с каким размером
+    и mtime и на какой угол получен каждый результат.
+
+    Хранится в выходной папке в файле .rotation_manifest.csv. По нему
+    повторный запуск пропускает изображения, которые не изменились.
+    """
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.entries: Dict[str, dict] = {}
+
+    @classmethod
+    def load(cls, folder: str) -> 'RotationManifest':
+        manifest = cls(folder)
+        if os.path.exists(manifest.path):
+            with open(manifest.path, 'r', newline='', encoding='utf-8') as f:
+                for entry in csv.DictReader(f):
+                    manifest.entries[entry['output']] = entry
+        return manifest
+
+    def save(self) -> None:
+        """Атомарно записывает манифест"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(self.entries.values())
+        os.replace(temp_path, self.path)
+
+    def is_up_to_date(self, output: str, source: str, stat: os.stat_result, angle: float,
+                      existing: set) -> bool:
+        """
+        Актуален ли результат output: он есть среди existing (имен файлов
+        выходной папки), а источник и угол те же, что при его создании.
+        """
+        entry = self.entries.get(output)
+        return (
+            entry is not None
+            and output in existing
+            and entry['source'] == source
+            and int(entry['size']) == stat.st_size
+            and int(entry['mtime_ns']) == stat.st_mtime_ns
+            and float(entry['angle']) == float(angle)
+        )
+
+    def record(self, output: str, source: str, stat: os.stat_result, angle: float) -> None:
+        """Запоминает, из чего получен результат output"""
+        self.entries[output] = {
+            'output': output,
+            'source': source,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'angle': repr(float(angle)),
+        }
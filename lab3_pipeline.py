@@ -0,0 +1,122 @@
+import os
+import threading
+from queue import Queue
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from lab_metrics import METRICS
+
+
+# Признак конца работы для потоков стадии
+STOP = None
+
+
+class RotationPipeline:
+    """
+    Конвейер поворота изображений: чтение -> поворот -> запись.
+
+    Каждая стадия - несколько потоков (OpenCV отпускает GIL в imread,
+    warpAffine и imwrite), стадии связаны очередями ограниченного
+    размера, поэтому медленный диск и тяжелый поворот выполняются
+    одновременно, а в памяти одновременно не больше queue_size
+    изображений на стадию. Каждый файл читается один раз, даже если
+    его нужно повернуть на несколько углов.
+
+    on_decode(номер задания, путь, изображение или None) вызывается из
+    потоков чтения для каждого прочитанного файла, например, чтобы взять
+    размеры из уже декодированного массива.
+    """
+
+    def __init__(self, rotate: Callable[[np.ndarray, float], np.ndarray],
+                 workers: int = 4, queue_size: Optional[int] = None,
+                 on_decode: Optional[Callable[[int, str, Optional[np.ndarray]], None]] = None) -> None:
+        if workers < 1:
+            raise ValueError(f"Число потоков на стадию должно быть положительным: {workers}")
+        self.rotate = rotate
+        self.workers = workers
+        self.queue_size = queue_size or 2 * workers
+        self.on_decode = on_decode
+
+    def _decode(self, item, output_queue: Queue) -> None:
+        index, input_path, outputs = item
+        with METRICS.stage('decode') as timer:
+            img = cv2.imread(input_path)
+            if METRICS.enabled and img is not None:
+                timer.bytes_read = os.path.getsize(input_path)
+        if self.on_decode is not None:
+            self.on_decode(index, input_path, img)
+        if img is None:
+            self.errors[index] = f"  ⚠️  Не удалось загрузить: {input_path}"
+            return
+        METRICS.count('images')
+        METRICS.count('pixels_read', img.shape[0] * img.shape[1])
+        # Одно декодированное изображение раздается на все углы
+        for angle, output_path in outputs:
+            output_queue.put((index, img, angle, output_path))
+
+    def _rotate(self, item, output_queue: Queue) -> None:
+        index, img, angle, output_path = item
+        with METRICS.stage('rotate'):
+            rotated = self.rotate(img, angle)
+        METRICS.count('pixels_written', rotated.shape[0] * rotated.shape[1])
+        output_queue.put((index, rotated, output_path))
+
+    def _encode(self, item, output_queue: Optional[Queue]) -> None:
+        index, rotated_img, output_path = item
+        with METRICS.stage('encode') as timer:
+            cv2.imwrite(output_path, rotated_img)
+            if METRICS.enabled:
+                timer.bytes_written = os.path.getsize(output_path)
+
+    def _stage(self, func, input_queue: Queue, output_queue: Optional[Queue]) -> None:
+        """Цикл потока стадии: берет задания из input_queue и передает результаты дальше"""
+        while True:
+            item = input_queue.get()
+            if item is STOP:
+                return
+            try:
+                func(item, output_queue)
+            except Exception as e:
+                self.errors[item[0]] = f"  ✗ Ошибка: {str(e)}"
+
+    def run(self, jobs: Iterable[Tuple[str, List[Tuple[float, str]]]]) -> List[Optional[str]]:
+        """
+        Обрабатывает задания (входной путь, [(угол, выходной путь), ...]).
+
+        jobs может быть генератором: задания берутся по мере освобождения
+        очереди чтения. Возвращает сообщения об ошибках в порядке заданий;
+        None - успех.
+        """
+        self.errors: List[Optional[str]] = []
+        decode_queue: Queue = Queue(maxsize=self.queue_size)
+        rotate_queue: Queue = Queue(maxsize=self.queue_size)
+        encode_queue: Queue = Queue(maxsize=self.queue_size)
+
+        stages = [
+            (self._decode, decode_queue, rotate_queue),
+            (self._rotate, rotate_queue, encode_queue),
+            (self._encode, encode_queue, None),
+        ]
+        threads = []
+        for func, input_queue, output_queue in stages:
+            stage_threads = [
+                threading.Thread(target=self._stage, args=(func, input_queue, output_queue), daemon=True)
+                for _ in range(self.workers)
+            ]
+            for thread in stage_threads:
+                thread.start()
+            threads.append((stage_threads, input_queue))
+
+        for index, (input_path, outputs) in enumerate(jobs):
+            self.errors.append(None)
+            decode_queue.put((index, input_path, outputs))
+
+        # Останавливаем стадии по порядку, чтобы каждая успела передать все дальше
+        for stage_threads, input_queue in threads:
+            for _ in stage_threads:
+                input_queue.put(STOP)
+            for thread in stage_threads:
+                thread.join()
+        return self.errors
@@ -0,0 +1,433 @@
+import mmap
+import os
+import struct
+import tempfile
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from lab3_var4 import rotation_geometry
+from lab_metrics import METRICS
+
+
+# Лимит памяти на полосу по умолчанию
+DEFAULT_MAX_MEMORY = 256 << 20
+# Заголовок BMP: BITMAPFILEHEADER (14 байт) + BITMAPINFOHEADER (40 байт), как пишет cv2.imwrite
+BMP_HEADER = struct.Struct('<2sIHHIIiiHHIIiiII')
+# Число пикселей в векторном блоке warpAffine; остаток строки считается отдельно
+WARP_BLOCK = 16
+# Наименьшая высота полосы при повороте на произвольный угол
+MIN_STRIP_ROWS = 64
+# Через сколько строк источника отпускать прочитанные страницы входного файла
+RELEASE_ROWS = 256
+# Запас вокруг области источника для билинейной интерполяции
+CROP_MARGIN = 2
+# Проверочное изображение и углы для сверки построчного поворота с полным кадром
+# (ширина не кратна WARP_BLOCK, чтобы проверить и хвост строки)
+CHECK_SHAPE = (41, 75, 3)
+CHECK_ANGLES = (33.3, -127.5)
+
+
+def map_file(path: str, offset: int, shape: Tuple[int, ...], writable: bool = False) -> np.ndarray:
+    """Массив uint8 поверх отображенного в память файла"""
+    with open(path, 'r+b' if writable else 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+    return np.frombuffer(buffer, dtype=np.uint8, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+
+def release_pages(array: np.ndarray) -> None:
+    """
+    Отпускает страницы файла, отображенного под массивом (map_file).
+
+    Данные остаются в файле и в кэше ОС, но перестают числиться за
+    процессом; при следующем обращении страницы подгрузятся снова.
+    """
+    base = array
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if isinstance(base, memoryview):
+        base = base.obj
+    if isinstance(base, mmap.mmap) and hasattr(base, 'madvise'):
+        base.madvise(mmap.MADV_DONTNEED)
+
+
+def open_bmp(path: str) -> Optional[np.ndarray]:
+    """
+    Отображает несжатый 24/32-битный BMP в память без декодирования.
+
+    Возвращает массив (высота, ширина, 3) в порядке BGR, как cv2.imread;
+    строки читаются с диска только при обращении к ним. Для других
+    форматов и вариантов BMP возвращает None.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(BMP_HEADER.size)
+        (magic, _, _, _, offset, info_size, width, height,
+         _, bpp, compression, _, _, _, _, _) = BMP_HEADER.unpack(header)
+    except (OSError, struct.error):
+        return None
+    if magic != b'BM' or info_size < 40 or compression != 0 or bpp not in (24, 32) or width <= 0 or height == 0:
+        return None
+
+    channels = bpp // 8
+    rows = abs(height)
+    stride = (width * channels + 3) // 4 * 4
+    data = map_file(path, offset, (rows, stride))
+    image = data[:, :width * channels].reshape(rows, width, channels)[:, :, :3]
+    # Положительная высота - строки хранятся снизу вверх
+    return image[::-1] if height > 0 else image
+
+
+def create_bmp(path: str, height: int, width: int) -> np.ndarray:
+    """Создает 24-битный BMP и возвращает его пиксели (сверху вниз) как массив в памяти файла"""
+    stride = (width * 3 + 3) // 4 * 4
+    with open(path, 'wb') as f:
+        f.write(BMP_HEADER.pack(b'BM', BMP_HEADER.size + stride * height, 0, 0, BMP_HEADER.size,
+                                40, width, height, 1, 24, 0, 0, 0, 0, 0, 0))
+        f.truncate(BMP_HEADER.size + stride * height)
+    data = map_file(path, BMP_HEADER.size, (height, stride), writable=True)
+    return data[::-1, :width * 3].reshape(height, width, 3)
+
+
+def right_angle(angle: float) -> Optional[int]:
+    """Число четвертей оборота против часовой стрелки для углов, кратных 90°"""
+    if float(angle).is_integer() and int(angle) % 90 == 0:
+        return int(angle) % 360 // 90
+    return None
+
+
+def rotated_shape(image_shape: Tuple[int, ...], angle: float) -> Tuple[int, ...]:
+    """Размер результата rotate_image для изображения размера image_shape"""
+    h, w = image_shape[:2]
+    quarters = right_angle(angle)
+    if quarters is not None:
+        size = (w, h) if quarters % 2 else (h, w)
+    else:
+        new_w, new_h = rotation_geometry(h, w, float(angle)).size
+        size = (new_h, new_w)
+    return size + tuple(image_shape[2:])
+
+
+def _right_angle_strip(image: np.ndarray, quarters: int, y0: int, y1: int) -> np.ndarray:
+    """Строки y0..y1 результата cv2.rotate, взятые из соответствующей полосы источника"""
+    h, w = image.shape[:2]
+    if quarters == 1:
+        return np.rot90(image[:, w - y1:w - y0], 1)
+    if quarters == 2:
+        return np.rot90(image[h - y1:h - y0], 2)
+    if quarters == 3:
+        return np.rot90(image[:, y0:y1], 3)
+    return image[y0:y1]
+
+
+def row_matrices(inverse: np.ndarray, y0: int, y1: int) -> np.ndarray:
+    """
+    Матрицы warpAffine для отдельных строк y0..y1 результата.
+
+    warpAffine (OpenCV 5) считает координату источника во float32 как
+    fma(M0, x, M1*y + M2). Строка с матрицей [M0, 0, M1*y + M2] при y = 0
+    дает те же координаты бит в бит, поэтому и те же пиксели.
+    """
+    m = inverse.astype(np.float32)
+    y = np.arange(y0, y1, dtype=np.float32)
+    matrices = np.zeros((y1 - y0, 2, 3), dtype=np.float64)
+    matrices[:, :, 0] = m[:, 0]
+    matrices[:, 0, 2] = m[0, 1] * y + m[0, 2]
+    matrices[:, 1, 2] = m[1, 1] * y + m[1, 2]
+    return matrices
+
+
+def tail_points(inverse: np.ndarray, y: int, width: int) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Пиксели хвоста строки после последнего векторного блока warpAffine.
+
+    Хвост считается в другом порядке: fma(M0, x, M1*y) + M2 во float32
+    (fma точно воспроизводится в float64). Для каждого пикселя выдается
+    (x, матрица для вывода 1x1 с этой координатой в сдвиге).
+    """
+    m = inverse.astype(np.float32)
+    row = (m[:, 1] * np.float32(y)).astype(np.float64)
+    for x in range(width - width % WARP_BLOCK, width):
+        point = (m[:, 0].astype(np.float64) * x + row).astype(np.float32) + m[:, 2]
+        yield x, np.array([[0, 0, point[0]], [0, 0, point[1]]], dtype=np.float64)
+
+
+def _warp_rows(source: np.ndarray, inverse: np.ndarray, y0: int, y1: int, strip: np.ndarray, flags: int) -> None:
+    """Строки y0..y1 результата по одной, с координатами бит в бит как у полного кадра"""
+    width = strip.shape[1]
+    for y, matrix in enumerate(row_matrices(inverse, y0, y1), y0):
+        strip[y - y0] = cv2.warpAffine(source, matrix, (width, 1), flags=flags)[0]
+        for x, point in tail_points(inverse, y, width):
+            strip[y - y0, x] = cv2.warpAffine(source, point, (1, 1), flags=flags)[0, 0]
+
+
+@lru_cache(maxsize=1)
+def rows_match_full_frame() -> bool:
+    """
+    Совпадает ли построчный поворот (_warp_rows) с rotate_image на этой
+    сборке OpenCV. row_matrices и tail_points повторяют арифметику
+    warpAffine OpenCV 5 (векторный блок WARP_BLOCK пикселей и порядок fma);
+    на другой сборке или ширине SIMD она может отличаться. Проверяется
+    один раз на маленьком изображении.
+    """
+    from lab3_var4 import rotate_image
+
+    image = np.random.default_rng(0).integers(0, 256, size=CHECK_SHAPE, dtype=np.uint8)
+    h, w = image.shape[:2]
+    for angle in CHECK_ANGLES:
+        expected = rotate_image(image, angle)
+        inverse = cv2.invertAffineTransform(rotation_geometry(h, w, angle).matrix)
+        strip = np.empty_like(expected)
+        _warp_rows(image, inverse, 0, len(expected), strip, cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+        if not np.array_equal(strip, expected):
+            return False
+    return True
+
+
+def source_spans(inverse: np.ndarray, y0: int, y1: int, width: int,
+                 h: int, w: int) -> Tuple[int, np.ndarray, np.ndarray]:
+    """
+    Части строк источника, которые нужны строкам y0..y1 результата.
+
+    Полоса результата переходит в параллелограмм источника; строка r
+    нужна точкам с координатой y от r - 1 до r + 1. Возвращает номер
+    первой строки и массивы начал и концов отрезков по строкам.
+    """
+    corners = np.array([[0, y0, 1], [width, y0, 1], [width, y1, 1], [0, y1, 1]], dtype=np.float64)
+    points = corners @ inverse.T
+    top = min(max(int(np.floor(points[:, 1].min())) - CROP_MARGIN, 0), h)
+    bottom = min(max(int(np.ceil(points[:, 1].max())) + CROP_MARGIN, top), h)
+    rows = np.arange(top, bottom, dtype=np.float64)
+    low = np.full(len(rows), np.inf)
+    high = np.full(len(rows), -np.inf)
+
+    for (px, py), (qx, qy) in zip(points, np.roll(points, -1, axis=0)):
+        if qy != py:
+            # Пересечения стороны с границами полосы строк
+            for level in (rows - 1, rows + 1):
+                inside = (level >= min(py, qy)) & (level <= max(py, qy))
+                x = px + (level - py) * (qx - px) / (qy - py)
+                low = np.where(inside, np.minimum(low, x), low)
+                high = np.where(inside, np.maximum(high, x), high)
+        # Вершины внутри полосы строк
+        inside = (rows - 1 <= py) & (py <= rows + 1)
+        low = np.where(inside, np.minimum(low, px), low)
+        high = np.where(inside, np.maximum(high, px), high)
+
+    starts = np.clip(np.floor(np.where(np.isfinite(low), low, w)) - CROP_MARGIN, 0, w).astype(np.int64)
+    ends = np.clip(np.ceil(np.where(np.isfinite(high), high, 0)) + CROP_MARGIN + 1, 0, w).astype(np.int64)
+    return top, starts, np.maximum(ends, starts)
+
+
+class SourceWindow:
+    """
+    Окно источника: массив размера всего изображения в анонимной памяти,
+    в котором заполнены только нужные полосе части строк.
+
+    warpAffine должен видеть изображение целиком в исходных координатах,
+    иначе изменится арифметика координат. Незаполненные страницы память
+    не занимают, а заполненные возвращаются системе перед следующей полосой.
+    """
+
+    def __init__(self, image: np.ndarray) -> None:
+        self.image = image
+        self.row_bytes = image.shape[1] * image.shape[2] * image.itemsize
+        self.buffer = mmap.mmap(-1, max(len(image) * self.row_bytes, 1))
+        self.array = np.frombuffer(self.buffer, dtype=image.dtype, count=image.size).reshape(image.shape)
+        self.loaded: Optional[Tuple[int, int]] = None
+
+    def load(self, top: int, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """Заполняет части строк источника, освободив предыдущие"""
+        self.release()
+        for row, (start, end) in enumerate(zip(starts.tolist(), ends.tolist()), top):
+            if start < end:
+                self.array[row, start:end] = self.image[row, start:end]
+            # ОС подгружает страницы файла с запасом вокруг каждого отрезка,
+            # поэтому отпускаем их, не дожидаясь конца полосы
+            if (row - top) % RELEASE_ROWS == RELEASE_ROWS - 1:
+                release_pages(self.image)
+        self.loaded = (top * self.row_bytes, (top + len(starts)) * self.row_bytes)
+        return self.array
+
+    def release(self) -> None:
+        if self.loaded is None:
+            return
+        start, end = self.loaded
+        start -= start % mmap.PAGESIZE
+        # Без madvise (Windows) страницы остаются занятыми до конца поворота
+        if hasattr(self.buffer, 'madvise') and end > start:
+            self.buffer.madvise(mmap.MADV_DONTNEED, start, end - start)
+        self.loaded = None
+
+    def close(self) -> None:
+        del self.array
+        self.buffer.close()
+
+
+def strip_height(image_shape: Tuple[int, ...], angle: float, max_memory: int) -> int:
+    """
+    Наибольшая высота полосы, при которой полоса и ее часть источника
+    укладываются в max_memory.
+
+    При повороте на произвольный угол даже одна строка результата
+    задевает много строк источника, поэтому меньше MIN_STRIP_ROWS строк
+    полоса не бывает, даже если max_memory меньше.
+    """
+    h, w = image_shape[:2]
+    # cv2.imread и open_bmp дают 8-битные изображения
+    pixel = image_shape[2] if len(image_shape) == 3 else 1
+    new_h, new_w = rotated_shape(image_shape, angle)[:2]
+
+    if right_angle(angle) is not None:
+        # Полоса результата, такая же полоса источника и их страницы в файлах
+        return int(min(max(max_memory // (4 * new_w * pixel), 1), new_h))
+
+    inverse = cv2.invertAffineTransform(rotation_geometry(h, w, float(angle)).matrix)
+
+    def cost(rows: int) -> int:
+        # Оцениваем по полосе в середине результата. Полоса лежит в памяти
+        # дважды (буфер и страницы выходного файла), части строк источника -
+        # тоже (окно и страницы входного файла), каждая - целыми страницами
+        y0 = max((new_h - rows) // 2, 0)
+        _, starts, ends = source_spans(inverse, y0, y0 + rows, new_w, h, w)
+        pages = ((ends - starts) * pixel + 2 * mmap.PAGESIZE - 1) // mmap.PAGESIZE
+        return 2 * rows * new_w * pixel + 2 * int(pages.sum()) * mmap.PAGESIZE
+
+    # Меньшие полосы почти не экономят память: каждая задевает те же строки источника
+    low, high = min(MIN_STRIP_ROWS, new_h), new_h
+    while low < high:
+        middle = (low + high + 1) // 2
+        if cost(middle) <= max_memory:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def iter_rotated_strips(image: np.ndarray, angle: float,
+                        max_memory: int = DEFAULT_MAX_MEMORY) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Поворачивает изображение полосами; выдает (номер первой строки, полоса).
+
+    Для каждой полосы из image читается только нужная ей область, поэтому
+    image может быть массивом в памяти файла (open_bmp). Склеенные полосы
+    совпадают с rotate_image пиксель в пиксель; построчный поворот примерно
+    в 5 раз медленнее полного кадра. Если rows_match_full_frame не
+    подтверждает совпадение на этой сборке OpenCV, изображение
+    поворачивается целиком, когда исходник и результат помещаются в
+    max_memory, иначе - RuntimeError.
+    """
+    h, w = image.shape[:2]
+    new_h, new_w = rotated_shape(image.shape, angle)[:2]
+    rows = strip_height(image.shape, angle, max_memory)
+    quarters = right_angle(angle)
+    if quarters is not None:
+        for y0 in range(0, new_h, rows):
+            y1 = min(y0 + rows, new_h)
+            yield y0, np.ascontiguousarray(_right_angle_strip(image, quarters, y0, y1))
+            release_pages(image)
+        return
+
+    if not rows_match_full_frame():
+        full_frame = image.nbytes + new_h * new_w * image.nbytes // (h * w)
+        if full_frame > max_memory:
+            raise RuntimeError(f"warpAffine OpenCV {cv2.__version__} считает координаты иначе, чем поворот "
+                               f"полосами, а полный кадр ({full_frame / (1 << 20):.1f} МБ) не помещается в лимит памяти")
+        from lab3_var4 import rotate_image
+
+        rotated = rotate_image(np.asarray(image), angle)
+        for y0 in range(0, new_h, rows):
+            yield y0, rotated[y0:y0 + rows]
+        return
+
+    inverse = cv2.invertAffineTransform(rotation_geometry(h, w, float(angle)).matrix)
+    flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP
+    # Изображение, уже декодированное в память, передаем как есть
+    window = None if type(image) is np.ndarray and image.flags.c_contiguous else SourceWindow(image)
+    source = image
+    try:
+        for y0 in range(0, new_h, rows):
+            y1 = min(y0 + rows, new_h)
+            if window is not None:
+                source = window.load(*source_spans(inverse, y0, y1, new_w, h, w))
+
+            strip = np.empty((y1 - y0, new_w) + image.shape[2:], dtype=image.dtype)
+            _warp_rows(source, inverse, y0, y1, strip, flags)
+            release_pages(image)
+            yield y0, strip
+    finally:
+        source = None
+        if window is not None:
+            window.close()
+
+
+def rotate_image_tiled(image: np.ndarray, angle: float, max_memory: int = DEFAULT_MAX_MEMORY,
+                       out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Поворот полосами в out (например, в массив в памяти выходного файла)"""
+    if out is None:
+        out = np.empty(rotated_shape(image.shape, angle), dtype=image.dtype)
+    for y0, strip in iter_rotated_strips(image, angle, max_memory):
+        out[y0:y0 + len(strip)] = strip
+        release_pages(out)
+    return out
+
+
+def process_image_tiled(input_path: str, outputs: List[Tuple[float, str]],
+                       max_memory: int = DEFAULT_MAX_MEMORY) -> Optional[Tuple[dict, List[Tuple[int, ...]]]]:
+    """
+    Как process_single_image, но с ограниченной памятью и сразу на все
+    углы из outputs = [(угол, выходной путь), ...]: файл декодируется один раз.
+
+    Несжатый BMP читается через отображение файла в память, результат
+    собирается полосами прямо в выходном файле (BMP) или во временном
+    файле рядом с ним, который затем кодируется cv2.imwrite. Сжатые
+    форматы OpenCV декодирует только целиком.
+
+    Возвращает (информация об изображении, [форма результата по углам])
+    или None, если файл не загрузился.
+    """
+    with METRICS.stage('decode'):
+        img = open_bmp(input_path)
+        if img is None:
+            img = cv2.imread(input_path)
+
+    if img is None:
+        print(f"  ⚠️  Не удалось загрузить: {input_path}")
+        return None
+
+    img_info = {
+        'original_size': img.shape,
+        'channels': img.shape[2] if len(img.shape) == 3 else 1,
+        'dtype': str(img.dtype)
+    }
+    return img_info, [write_rotated_tiled(img, angle, output_path, max_memory) for angle, output_path in outputs]
+
+
+def write_rotated_tiled(img: np.ndarray, angle: float, output_path: str,
+                        max_memory: int = DEFAULT_MAX_MEMORY) -> Tuple[int, ...]:
+    """Поворачивает img полосами в выходной файл; возвращает форму результата"""
+    shape = rotated_shape(img.shape, angle)
+
+    if output_path.lower().endswith('.bmp') and img.dtype == np.uint8 and shape[2:] == (3,):
+        out = create_bmp(output_path, shape[0], shape[1])
+        with METRICS.stage('rotate'):
+            rotate_image_tiled(img, angle, max_memory, out)
+        del out
+        return shape
+
+    fd, temp_path = tempfile.mkstemp(suffix='.raw', dir=os.path.dirname(output_path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.truncate(int(np.prod(shape)))
+        out = map_file(temp_path, 0, shape, writable=True)
+        with METRICS.stage('rotate'):
+            rotate_image_tiled(img, angle, max_memory, out)
+        # Кодировщикам OpenCV нужен весь кадр; его страницы берутся из файла
+        with METRICS.stage('encode'):
+            cv2.imwrite(output_path, out)
+        del out
+    finally:
+        os.remove(temp_path)
+    return shape
@@ -1,35 +1,107 @@
-import cv2
-import numpy as np
 import argparse
+import math
+import os
+from functools import lru_cache
 from pathlib import Path
 
+from lab_metrics import METRICS, add_arguments, instrumented
 
-def rotate_image(image, angle):
+
+# Сколько разных сочетаний (высота, ширина, угол) хранить в кэше геометрии
+GEOMETRY_CACHE_SIZE = 64
+
+# Расширения изображений (в нижнем регистре), которые ищутся во входной папке
+SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.webp'}
+
+
+# Повороты на углы, кратные 90°, без интерполяции (против часовой стрелки);
+# имена констант cv2, чтобы OpenCV загружался только при первом повороте
+RIGHT_ANGLE_ROTATIONS = {
+    90: 'ROTATE_90_COUNTERCLOCKWISE',
+    180: 'ROTATE_180',
+    270: 'ROTATE_90_CLOCKWISE',
+}
+
+
+class RotationGeometry:
     """
-    Поворачивает изображение на заданный угол вокруг центра.
+    Геометрия поворота для заданных размеров и угла: матрица аффинного
+    преобразования, размер результата и (по требованию) карты для cv2.remap.
     """
-    # Получаем размеры изображения
-    (h, w) = image.shape[:2]
 
-    # Вычисляем центр изображения
-    center = (w // 2, h // 2)
+    def __init__(self, h, w, angle):
+        import cv2
+        import numpy as np
+
+        # Вычисляем центр изображения
+        center = (w // 2, h // 2)
+
+        # Получаем матрицу поворота
+        rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+
+        # Вычисляем новые размеры изображения после поворота
+        cos = np.abs(rotation_matrix[0, 0])
+        sin = np.abs(rotation_matrix[0, 1])
+
+        new_w = int((h * sin) + (w * cos))
+        new_h = int((h * cos) + (w * sin))
 
-    # Получаем матрицу поворота
-    rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+        # Корректируем матрицу поворота с учетом новых размеров
+        rotation_matrix[0, 2] += (new_w / 2) - center[0]
+        rotation_matrix[1, 2] += (new_h / 2) - center[1]
 
-    # Вычисляем новые размеры изображения после поворота
-    cos = np.abs(rotation_matrix[0, 0])
-    sin = np.abs(rotation_matrix[0, 1])
+        # Геометрия разделяется между потоками, поэтому защищаем ее от изменений
+        rotation_matrix.flags.writeable = False
+        self.matrix = rotation_matrix
+        self.size = (new_w, new_h)
+        self._maps = None
 
-    new_w = int((h * sin) + (w * cos))
-    new_h = int((h * cos) + (w * sin))
+    def remap_maps(self):
+        """Карты координат в формате CV_16SC2 для cv2.remap, считаются один раз"""
+        if self._maps is None:
+            import cv2
+            import numpy as np
+
+            new_w, new_h = self.size
+            inverse = cv2.invertAffineTransform(self.matrix)
+            xs, ys = np.meshgrid(np.arange(new_w, dtype=np.float32), np.arange(new_h, dtype=np.float32))
+            map_x = (inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]).astype(np.float32)
+            map_y = (inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]).astype(np.float32)
+            self._maps = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+        return self._maps
+
+
+@lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def rotation_geometry(h, w, angle):
+    """Геометрия поворота из кэша: для папки с одинаковыми размерами считается один раз"""
+    return RotationGeometry(h, w, angle)
+
+
+def rotate_image(image, angle, use_remap=False):
+    """
+    Поворачивает изображение на заданный угол вокруг центра.
+
+    Углы, кратные 90°, поворачиваются без интерполяции через cv2.rotate.
+    use_remap применяет закэшированные карты cv2.remap вместо warpAffine.
+    """
+    import cv2
+
+    if float(angle).is_integer() and int(angle) % 90 == 0:
+        right_angle = int(angle) % 360
+        if right_angle == 0:
+            return image.copy()
+        return cv2.rotate(image, getattr(cv2, RIGHT_ANGLE_ROTATIONS[right_angle]))
+
+    # Получаем размеры изображения
+    (h, w) = image.shape[:2]
+    geometry = rotation_geometry(h, w, float(angle))
 
-    # Корректируем матрицу поворота с учетом новых размеров
-    rotation_matrix[0, 2] += (new_w / 2) - center[0]
-    rotation_matrix[1, 2] += (new_h / 2) - center[1]
+    if use_remap:
+        map1, map2 = geometry.remap_maps()
+        return cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
 
     # Применяем аффинное преобразование
-    rotated_image = cv2.warpAffine(image, rotation_matrix, (new_w, new_h))
+    rotated_image = cv2.warpAffine(image, geometry.matrix, geometry.size)
 
     return rotated_image
 
@@ -38,8 +110,13 @@ def process_single_image(input_path, output_path, angle, show_preview=False):
     """
     Обрабатывает одно изображение.
     """
+    import cv2
+
     # Загружаем изображение
-    img = cv2.imread(input_path)
+    with METRICS.stage('decode') as timer:
+        img = cv2.imread(input_path)
+        if METRICS.enabled and img is not None:
+            timer.bytes_read = os.path.getsize(input_path)
 
     if img is None:
         print(f"  ⚠️  Не удалось загрузить: {input_path}")
@@ -53,45 +130,49 @@ def process_single_image(input_path, output_path, angle, show_preview=False):
     }
 
     # Поворачиваем изображение
-    rotated_img = rotate_image(img, angle)
+    with METRICS.stage('rotate'):
+        rotated_img = rotate_image(img, angle)
 
     # Сохраняем результат
-    cv2.imwrite(output_path, rotated_img)
+    with METRICS.stage('encode') as timer:
+        cv2.imwrite(output_path, rotated_img)
+        if METRICS.enabled:
+            timer.bytes_written = os.path.getsize(output_path)
 
     return True, img_info, rotated_img.shape
 
 
-def process_folder(input_folder, output_folder, angle, preview=False):
-    input_path = Path(input_folder)
+def record_image_info(img_info, new_size):
+    """Счетчики метрик по информации об обработанном изображении"""
+    height, width = img_info['original_size'][:2]
+    METRICS.count('images')
+    METRICS.count(f"images_{img_info['channels']}ch_{img_info['dtype']}")
+    METRICS.count('pixels_read', height * width)
+    METRICS.count('pixels_written', new_size[0] * new_size[1])
 
-    if not input_path.exists():
-        print(f"Ошибка: папка '{input_folder}' не найдена!")
-        return
 
-    output_path = Path(output_folder)
-    output_path.mkdir(parents=True, exist_ok=True)
+def rotated_filename(image_path, angle):
+    """Имя выходного файла: <имя>_rotated_<угол>deg<расширение>"""
+    return f"{image_path.stem}_rotated_{angle_label(angle)}deg{image_path.suffix}"
 
-    supported_formats = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.webp']
 
-    image_files = []
-    for format in supported_formats:
-        image_files.extend(list(input_path.glob(f'*{format}')))
-        image_files.extend(list(input_path.glob(f'*{format.upper()}')))
+def angle_label(angle):
+    """Угол в имени файла: целый - без дробной части (30), дробный - как есть (22.5)"""
+    return str(int(angle)) if float(angle).is_integer() else f"{angle:g}"
 
-    if not image_files:
-        print("Не найдено изображений в папке!")
-        return
 
+def process_files(image_files, output_path, angle, on_success=None):
+    """
+    Последовательно поворачивает файлы; возвращает (успешно, с ошибкой).
+
+    on_success вызывается как on_success(путь, угол) для каждого готового файла.
+    """
     successful = 0
     failed = 0
 
     for i, image_path in enumerate(image_files, 1):
 
-        name_without_ext = image_path.stem
-        extension = image_path.suffix
-
-        output_filename = f"{name_without_ext}_rotated_{int(angle)}deg{extension}"
-        output_filepath = output_path / output_filename
+        output_filepath = output_path / rotated_filename(image_path, angle)
 
 
         try:
@@ -105,6 +186,9 @@ def process_folder(input_folder, output_folder, angle, preview=False):
 
             if success:
                 successful += 1
+                record_image_info(img_info, new_size)
+                if on_success is not None:
+                    on_success(image_path, angle)
             else:
                 failed += 1
 
@@ -112,11 +196,206 @@ def process_folder(input_folder, output_folder, angle, preview=False):
             print(f"  ✗ Ошибка: {str(e)}")
             failed += 1
 
+    return successful, failed
+
+
+def process_files_parallel(image_files, output_path, angles, workers, on_success=None):
+    """
+    Поворачивает файлы конвейером потоков на все углы из angles.
+
+    Каждый файл декодируется один раз; ошибки печатаются в порядке файлов.
+    """
+    from lab3_pipeline import RotationPipeline
+
+    jobs = [
+        (str(image_path), [(angle, str(output_path / rotated_filename(image_path, angle))) for angle in angles])
+        for image_path in image_files
+    ]
+    errors = RotationPipeline(rotate_image, workers=workers).run(jobs)
+
+    successful = 0
+    failed = 0
+    for image_path, error in zip(image_files, errors):
+        if error is None:
+            successful += 1
+            if on_success is not None:
+                for angle in angles:
+                    on_success(image_path, angle)
+        else:
+            print(error)
+            failed += 1
+    return successful, failed
+
+
+def process_files_tiled(image_files, output_path, angles, max_memory, on_success=None):
+    """
+    Последовательно поворачивает файлы полосами с ограниченной памятью
+    (lab3_tiled) на все углы из angles; результат тот же, что без лимита.
+
+    Каждый файл декодируется один раз и считается одним файлом, как в
+    process_files_parallel: ошибка на любом угле - файл с ошибкой.
+    """
+    from lab3_tiled import process_image_tiled
+
+    successful = 0
+    failed = 0
+    for image_path in image_files:
+        outputs = [(angle, str(output_path / rotated_filename(image_path, angle))) for angle in angles]
+        try:
+            result = process_image_tiled(str(image_path), outputs, max_memory)
+        except Exception as e:
+            print(f"  ✗ Ошибка: {str(e)}")
+            failed += 1
+            continue
+        if result is None:
+            failed += 1
+            continue
+
+        img_info, shapes = result
+        successful += 1
+        record_image_info(img_info, shapes[0])
+        for shape in shapes[1:]:
+            METRICS.count('pixels_written', shape[0] * shape[1])
+        if on_success is not None:
+            for angle in angles:
+                on_success(image_path, angle)
+    return successful, failed
+
+
+def positive_int(value):
+    """Тип argparse: целое число больше нуля"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается целое число: {value}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"должно быть положительным: {value}")
+    return number
+
+
+def parse_angles(spec):
+    """
+    Разбирает список углов: "15,30,45" или диапазоны "начало:конец[:шаг]"
+    (конец не включается), например "0:360:15".
+
+    Повторы одного угла отбрасываются; разные углы, которые дают одно имя
+    выходного файла, - ошибка.
+    """
+    angles = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if ':' not in part:
+            angles.append(float(part))
+            continue
+
+        bounds = [float(value) for value in part.split(':')]
+        if len(bounds) not in (2, 3):
+            raise ValueError(f"Неверный диапазон углов: {part}")
+        start, stop = bounds[0], bounds[1]
+        step = bounds[2] if len(bounds) == 3 else 1.0
+        if step <= 0:
+            raise ValueError(f"Шаг диапазона углов должен быть положительным: {part}")
+        # Считаем от начала, а не накапливаем шаг, чтобы не копить ошибку округления
+        count = math.ceil((stop - start) / step)
+        angles.extend(start + i * step for i in range(max(count, 0)))
+    if not angles:
+        raise ValueError(f"Не задано ни одного угла: {spec}")
+
+    unique = {}
+    for angle in angles:
+        label = angle_label(angle)
+        if label in unique and unique[label] != angle:
+            raise ValueError(f"Углы {unique[label]!r} и {angle!r} дают одно имя файла (_rotated_{label}deg)")
+        unique.setdefault(label, angle)
+    return list(unique.values())
+
+
+def find_images(folder):
+    """Изображения папки за один проход os.scandir; регистр расширения не важен"""
+    with os.scandir(folder) as entries:
+        return sorted(
+            Path(entry.path) for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in SUPPORTED_FORMATS
+        )
+
+
+def process_folder(input_folder, output_folder, angle, preview=False, workers=None, angles=None,
+                   max_memory=None, incremental=False):
+    input_path = Path(input_folder)
+    angles = angles or [angle]
+
+    if not input_path.exists():
+        print(f"Ошибка: папка '{input_folder}' не найдена!")
+        return
+
+    output_path = Path(output_folder)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    image_files = find_images(input_path)
+
+    if not image_files:
+        print("Не найдено изображений в папке!")
+        return
+
+    if workers is None:
+        # Для нескольких углов кодирование результатов распараллеливаем по умолчанию
+        workers = min(len(angles), os.cpu_count() or 1) if len(angles) > 1 else 1
+
+    # Файлы, сгруппированные по углам, на которые их осталось повернуть
+    groups = {tuple(angles): image_files}
+    skipped = 0
+    on_success = None
+    if incremental:
+        from lab3_manifest import RotationManifest
+
+        manifest = RotationManifest.load(str(output_path))
+        with os.scandir(output_path) as entries:
+            existing = {entry.name for entry in entries}
+        stats = {image_path: image_path.stat() for image_path in image_files}
+
+        groups = {}
+        for image_path in image_files:
+            source = os.path.abspath(image_path)
+            pending = tuple(
+                rotation_angle for rotation_angle in angles
+                if not manifest.is_up_to_date(rotated_filename(image_path, rotation_angle), source,
+                                              stats[image_path], rotation_angle, existing)
+            )
+            skipped += len(angles) - len(pending)
+            if pending:
+                groups.setdefault(pending, []).append(image_path)
+
+        def on_success(image_path, rotation_angle):
+            manifest.record(rotated_filename(image_path, rotation_angle), os.path.abspath(image_path),
+                            stats[image_path], rotation_angle)
+
+    successful, failed = 0, 0
+    try:
+        for group_angles, group_files in groups.items():
+            if max_memory is not None:
+                # Конвейер держит в памяти целые изображения, поэтому с лимитом - по одному
+                done, errors = process_files_tiled(group_files, output_path, list(group_angles), max_memory,
+                                                   on_success)
+            elif workers > 1 or len(angles) > 1:
+                done, errors = process_files_parallel(group_files, output_path, list(group_angles), workers,
+                                                      on_success)
+            else:
+                done, errors = process_files(group_files, output_path, group_angles[0], on_success=on_success)
+            successful += done
+            failed += errors
+    finally:
+        if incremental:
+            manifest.save()
+
     print("\n" + "=" * 60)
     print("СТАТИСТИКА ОБРАБОТКИ")
     print("=" * 60)
     print(f"Успешно обработано: {successful}")
     print(f"Не удалось обработать: {failed}")
+    if incremental:
+        print(f"Пропущено (уже актуальны): {skipped}")
     print(f"Выходная папка: {output_folder}")
     print("=" * 60)
 
@@ -135,9 +414,16 @@ def main():
     parser.add_argument(
         'angle',
         type=float,
+        nargs='?',
         help='Угол поворота в градусах (положительный - против часовой стрелки)'
     )
 
+    parser.add_argument(
+        '-a', '--angles',
+        type=str,
+        help='Несколько углов за одно чтение файлов: "15,30,45" или диапазон "0:360:15"'
+    )
+
     parser.add_argument(
         '-o', '--output',
         type=str,
@@ -152,17 +438,53 @@ def main():
         help='Показать предпросмотр результатов'
     )
 
+    parser.add_argument(
+        '-w', '--workers',
+        type=positive_int,
+        default=None,
+        help='Число потоков на каждую стадию (чтение, поворот, запись)'
+    )
+
+    parser.add_argument(
+        '-m', '--max-memory',
+        type=float,
+        default=None,
+        help='Поворачивать полосами, ограничив память на изображение (в МБ); результат тот же. '
+             'Если OpenCV считает координаты не так, как поворот полосами, изображение '
+             'поворачивается целиком, а не помещающееся в лимит - пропускается с ошибкой'
+    )
+
+    parser.add_argument(
+        '-i', '--incremental',
+        action='store_true',
+        help='Пропускать изображения, для которых результат уже есть и источник не менялся'
+    )
+
     parser.add_argument(
         '-v', '--verbose',
         action='store_true',
         help='Подробный вывод информации'
     )
 
+    add_arguments(parser)
+
     # Парсим аргументы
     args = parser.parse_args()
 
+    angles = None
+    if args.angles:
+        try:
+            angles = parse_angles(args.angles)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.angle is None:
+        parser.error('укажите угол поворота или --angles')
+
     # Обрабатываем папку
-    process_folder(args.input_folder, args.output, args.angle, args.preview)
+    max_memory = int(args.max_memory * (1 << 20)) if args.max_memory else None
+    with instrumented(args):
+        process_folder(args.input_folder, args.output, args.angle, args.preview, args.workers, angles, max_memory,
+                       args.incremental)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+import csv
+import heapq
+import os
+import shutil
+import tempfile
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from lab4_var4 import AREA_BINS, COLUMN_NAMES, add_image_area_column, area_labels, drop_metadata_columns, report_error
+
+
+DEFAULT_CHUNK_SIZE = 100000
+# Сколько отсортированных частей сливается за один проход
+MERGE_FAN_IN = 64
+
+
+def iter_annotation_chunks(csv_file: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Читает CSV аннотации частями по chunk_size строк"""
+    for chunk in pd.read_csv(csv_file, encoding='utf-8', chunksize=chunk_size):
+        yield chunk.rename(columns=COLUMN_NAMES)
+
+
+class ExternalSorter:
+    """
+    Внешняя сортировка строк по целочисленной колонке.
+
+    Каждая часть сортируется в памяти и записывается во временный CSV,
+    затем части сливаются heapq.merge не больше чем по MERGE_FAN_IN за
+    раз, поэтому в памяти одновременно только одна часть. Сортировка
+    устойчивая: строки с равным ключом остаются в порядке поступления.
+    """
+
+    def __init__(self, key: str, temp_dir: Optional[str] = None, fan_in: int = MERGE_FAN_IN) -> None:
+        self.key = key
+        self.fan_in = fan_in
+        self.folder = tempfile.mkdtemp(prefix='lab4_sort_', dir=temp_dir)
+        self.runs: List[str] = []
+        self.created = 0
+        self.header: Optional[List[str]] = None
+
+    def _run_path(self) -> str:
+        self.created += 1
+        return os.path.join(self.folder, f"run_{self.created:06d}.csv")
+
+    def add(self, chunk: pd.DataFrame) -> None:
+        """Сортирует часть и сохраняет ее как отдельный отсортированный файл"""
+        if self.header is None:
+            self.header = list(chunk.columns)
+        path = self._run_path()
+        chunk.sort_values(by=self.key, kind='stable').to_csv(path, index=False, header=False, encoding='utf-8')
+        self.runs.append(path)
+
+    def _merge(self, runs: List[str], output, key_index: int) -> None:
+        files = [open(path, 'r', newline='', encoding='utf-8') for path in runs]
+        try:
+            readers = [csv.reader(f) for f in files]
+            writer = csv.writer(output, lineterminator='\n')
+            writer.writerows(heapq.merge(*readers, key=lambda row: int(row[key_index])))
+        finally:
+            for f in files:
+                f.close()
+
+    def merge_to(self, output_path: str) -> None:
+        """Сливает части в отсортированный CSV output_path с заголовком"""
+        key_index = self.header.index(self.key) if self.header else 0
+        runs = self.runs
+        # Промежуточные проходы, пока частей больше, чем можно открыть сразу
+        while len(runs) > self.fan_in:
+            merged = []
+            for start in range(0, len(runs), self.fan_in):
+                path = self._run_path()
+                with open(path, 'w', newline='', encoding='utf-8') as f:
+                    self._merge(runs[start:start + self.fan_in], f, key_index)
+                for run in runs[start:start + self.fan_in]:
+                    os.remove(run)
+                merged.append(path)
+            runs = merged
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            if self.header is not None:
+                csv.writer(f, lineterminator='\n').writerow(self.header)
+            self._merge(runs, f, key_index)
+        self.runs = runs
+
+    def close(self) -> None:
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+class ChunkedAnalysis:
+    """
+    Анализ аннотации по частям с ограниченной памятью.
+
+    Каждая часть CSV получает площади и категории, сразу дописывается в
+    выходной CSV и в фильтрованный CSV, а счетчики категорий, число
+    отфильтрованных файлов и наименьшие площади накапливаются по ходу.
+    Полная сортировка по площади - внешним слиянием.
+    """
+
+    def __init__(self, bins=AREA_BINS, min_area: int = 50000, max_area: float = 500000,
+                 workers: int = 16, cache_path: Optional[str] = None, top: int = 5,
+                 hash_content: bool = False) -> None:
+        self.bins = bins
+        self.min_area = min_area
+        self.max_area = max_area
+        self.workers = workers
+        self.cache_path = cache_path
+        self.hash_content = hash_content
+        self.top = top
+        self.rows = 0
+        self.filtered = 0
+        self.counts = pd.Series(0, index=pd.Index(area_labels(bins), name='area_category'), name='count')
+        self.smallest = np.empty(0, dtype=np.int64)
+
+    def run(self, csv_file: str, output_csv: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+            filtered_csv: Optional[str] = None, sorted_csv: Optional[str] = None) -> None:
+        cache = None
+        if self.cache_path is not None:
+            from lab4_metadata import MetadataCache
+
+            cache = MetadataCache(self.cache_path, self.hash_content)
+        sorter = ExternalSorter('image_area', temp_dir=os.path.dirname(os.path.abspath(output_csv))) if sorted_csv else None
+        try:
+            for i, chunk in enumerate(iter_annotation_chunks(csv_file, chunk_size)):
+                if cache is not None:
+                    chunk = cache.attach(chunk, workers=self.workers, on_error=report_error)
+                chunk = drop_metadata_columns(add_image_area_column(chunk, workers=self.workers, bins=self.bins))
+                self._accumulate(chunk)
+
+                first = i == 0
+                chunk.to_csv(output_csv, mode='w' if first else 'a', header=first, index=False, encoding='utf-8')
+                if filtered_csv is not None:
+                    areas = chunk['image_area'].to_numpy()
+                    selected = chunk[(areas >= self.min_area) & (areas <= self.max_area)]
+                    selected.to_csv(filtered_csv, mode='w' if first else 'a', header=first, index=False, encoding='utf-8')
+                if sorter is not None:
+                    sorter.add(chunk)
+            if sorter is not None:
+                sorter.merge_to(sorted_csv)
+        finally:
+            if cache is not None:
+                cache.close()
+            if sorter is not None:
+                sorter.close()
+
+    def _accumulate(self, chunk: pd.DataFrame) -> None:
+        areas = chunk['image_area'].to_numpy()
+        self.rows += len(chunk)
+        self.filtered += int(np.count_nonzero((areas >= self.min_area) & (areas <= self.max_area)))
+        self.counts += chunk['area_category'].value_counts(sort=False).to_numpy()
+        candidates = np.concatenate([self.smallest, areas])
+        if len(candidates) > self.top:
+            candidates = np.partition(candidates, self.top - 1)[:self.top]
+        self.smallest = np.sort(candidates)
@@ -0,0 +1,182 @@
+import math
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lab_metrics import METRICS
+
+
+# Сколько байт начала файла читается для разбора заголовка
+HEADER_BYTES = 512
+DEFAULT_WORKERS = 16
+# Маркеры JPEG SOF с размерами кадра (C4, C8 и CC - не кадры)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Маркеры JPEG без длины сегмента
+JPEG_STANDALONE_MARKERS = {0x01, 0xD8} | set(range(0xD0, 0xD8))
+
+
+def png_size(header: bytes) -> Optional[Tuple[int, int]]:
+    """Размеры из чанка IHDR, который всегда идет первым"""
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+        return struct.unpack('>II', header[16:24])
+    return None
+
+
+def gif_size(header: bytes) -> Optional[Tuple[int, int]]:
+    """Размеры логического экрана GIF"""
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', header[6:10])
+    return None
+
+
+def bmp_size(header: bytes) -> Optional[Tuple[int, int]]:
+    """Размеры из BITMAPCOREHEADER или BITMAPINFOHEADER и его потомков"""
+    if header[:2] != b'BM' or len(header) < 26:
+        return None
+    info_size = struct.unpack('<I', header[14:18])[0]
+    if info_size == 12:
+        return struct.unpack('<HH', header[18:22])
+    width, height = struct.unpack('<ii', header[18:26])
+    # Отрицательная высота означает порядок строк сверху вниз
+    return width, abs(height)
+
+
+def webp_size(header: bytes) -> Optional[Tuple[int, int]]:
+    """Размеры из первого чанка WebP: VP8 (с потерями), VP8L (без потерь) или VP8X (расширенный)"""
+    if header[:4] != b'RIFF' or header[8:12] != b'WEBP' or len(header) < 30:
+        return None
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and header[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and header[20] == 0x2F:
+        bits = int.from_bytes(header[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        return int.from_bytes(header[24:27], 'little') + 1, int.from_bytes(header[27:30], 'little') + 1
+    return None
+
+
+def jpeg_size(file: BinaryIO) -> Optional[Tuple[int, int]]:
+    """
+    Размеры из сегмента SOF JPEG.
+
+    Сегменты до SOF (EXIF с миниатюрой, ICC-профиль) могут занимать
+    десятки килобайт, поэтому они пропускаются seek, а не читаются.
+    """
+    file.seek(0)
+    if file.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        byte = file.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = file.read(1)
+        # Байты заполнения 0xFF перед маркером
+        while marker == b'\xff':
+            marker = file.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code in JPEG_STANDALONE_MARKERS or code == 0x00:
+            continue
+        if code == 0xD9:
+            return None
+        length = file.read(2)
+        if len(length) < 2:
+            return None
+        if code in JPEG_SOF_MARKERS:
+            frame = file.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>HH', frame[1:5])
+            return width, height
+        file.seek(struct.unpack('>H', length)[0] - 2, 1)
+
+
+HEADER_PARSERS = {'PNG': png_size, 'GIF': gif_size, 'BMP': bmp_size, 'WEBP': webp_size}
+
+
+def probe_image(path: str) -> Tuple[int, int, str]:
+    """Как _probe_image, с замером стадии probe"""
+    with METRICS.stage('probe'):
+        return _probe_image(path)
+
+
+def _probe_image(path: str) -> Tuple[int, int, str]:
+    """
+    Ширина, высота и формат изображения по заголовку файла, как
+    Image.open(path).size и .format.
+
+    JPEG, PNG, GIF, BMP и WebP разбираются без декодирования; остальные
+    форматы открываются через PIL. Для нечитаемого файла бросает исключение.
+    """
+    with open(path, 'rb') as file:
+        header = file.read(HEADER_BYTES)
+        for image_format, parser in HEADER_PARSERS.items():
+            size = parser(header)
+            if size is not None:
+                return size[0], size[1], image_format
+        if header[:2] == b'\xff\xd8':
+            size = jpeg_size(file)
+            if size is not None:
+                return size[0], size[1], 'JPEG'
+
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.size[0], img.size[1], img.format
+
+
+def image_size(path: str) -> Tuple[int, int]:
+    """Ширина и высота изображения по заголовку файла, как Image.open(path).size"""
+    width, height, _ = probe_image(path)
+    return width, height
+
+
+def map_paths(func: Callable[[str], Any], paths: Sequence[str], workers: int = DEFAULT_WORKERS,
+              on_error: Optional[Callable[[str, Exception], None]] = None) -> List[Any]:
+    """
+    Вызывает func для всех путей в пуле потоков; возвращает результаты в
+    порядке paths, None - при ошибке, которая передается в
+    on_error(путь, исключение) в порядке paths.
+    """
+    results: List[Any] = [None] * len(paths)
+
+    def run(bounds: Tuple[int, int]) -> list:
+        # Поток обрабатывает сразу кусок путей, чтобы не платить за задачу на каждый файл
+        errors = []
+        for i in range(*bounds):
+            try:
+                results[i] = func(paths[i])
+            except Exception as e:
+                errors.append((paths[i], e))
+        return errors
+
+    chunk = max(1, math.ceil(len(paths) / (workers * 4)))
+    chunks = [(start, min(start + chunk, len(paths))) for start in range(0, len(paths), chunk)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for errors in pool.map(run, chunks):
+            if on_error is not None:
+                for path, error in errors:
+                    on_error(path, error)
+    return results
+
+
+def read_dimensions(paths: Sequence[str], workers: int = DEFAULT_WORKERS,
+                    on_error: Optional[Callable[[str, Exception], None]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Размеры всех изображений из paths в пуле потоков.
+
+    Возвращает numpy-массивы ширин и высот в порядке paths; для файлов,
+    которые не удалось прочитать, оба значения -1, а ошибка передается в
+    on_error(путь, исключение) в порядке paths.
+    """
+    sizes = map_paths(image_size, paths, workers, on_error)
+    widths = np.fromiter((size[0] if size else -1 for size in sizes), dtype=np.int64, count=len(sizes))
+    heights = np.fromiter((size[1] if size else -1 for size in sizes), dtype=np.int64, count=len(sizes))
+    return widths, heights
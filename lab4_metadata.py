@@ -0,0 +1,142 @@
+import os
+import sqlite3
+from functools import partial
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from lab4_dimensions import DEFAULT_WORKERS, map_paths, probe_image
+
+
+DEFAULT_CACHE_NAME = '.image_metadata.sqlite'
+# Записей на один запрос по ключу и доля кэша, с которой он читается целиком
+LOOKUP_BATCH = 900
+LOOKUP_ALL_RATIO = 4
+COLUMNS = ['path', 'mtime_ns', 'size', 'width', 'height', 'area', 'format', 'sha256']
+# Колонки, которые attach добавляет к DataFrame сверх image_area
+METADATA_COLUMNS = ['width', 'height', 'format', 'sha256']
+
+
+def probe_file(path: str, hash_content: bool = False) -> Tuple[int, int, int, int, int, str, Optional[str]]:
+    """
+    Метаданные файла для кэша: mtime_ns, размер, ширина, высота, площадь,
+    формат и SHA-256. Хэш читает файл целиком, поэтому считается только
+    с hash_content; иначе вместо него None.
+    """
+    stat = os.stat(path)
+    width, height, image_format = probe_image(path)
+    sha256 = None
+    if hash_content:
+        from lab2_manifest import file_sha256
+
+        sha256 = file_sha256(path)
+    return stat.st_mtime_ns, stat.st_size, width, height, width * height, image_format, sha256
+
+
+def file_stamp(path: str) -> Tuple[int, int]:
+    """mtime_ns и размер файла; (-1, -1), если файла нет"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return -1, -1
+    return stat.st_mtime_ns, stat.st_size
+
+
+class MetadataCache:
+    """
+    Постоянный кэш метаданных изображений в SQLite.
+
+    Запись о файле действительна, пока совпадают его путь, mtime и размер,
+    поэтому при повторном анализе открываются только новые и измененные
+    файлы. Файлы, которые не удалось прочитать, в кэш не попадают.
+    С hash_content записи без SHA-256 тоже считаются устаревшими.
+    """
+
+    def __init__(self, path: str, hash_content: bool = False) -> None:
+        self.path = path
+        self.hash_content = hash_content
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS images ('
+            'path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, width INTEGER, '
+            'height INTEGER, area INTEGER, format TEXT, sha256 TEXT)'
+        )
+
+    def __enter__(self) -> 'MetadataCache':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def lookup(self, paths: list) -> list:
+        """Записи кэша (mtime_ns, размер, ширина, высота, площадь, формат, sha256) в порядке paths; None - нет записи"""
+        columns = ', '.join(COLUMNS)
+        total = self.connection.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+        if len(paths) * LOOKUP_ALL_RATIO >= total:
+            # Нужна заметная часть кэша: прочитать его целиком быстрее, чем искать по ключу
+            rows = self.connection.execute(f"SELECT {columns} FROM images").fetchall()
+        else:
+            # Небольшая часть большого кэша (анализ по частям): только нужные записи
+            rows = []
+            for start in range(0, len(paths), LOOKUP_BATCH):
+                batch = paths[start:start + LOOKUP_BATCH]
+                rows.extend(self.connection.execute(
+                    f"SELECT {columns} FROM images WHERE path IN ({', '.join('?' * len(batch))})", batch
+                ))
+        entries = {row[0]: row[1:] for row in rows}
+        return [entries.get(path) for path in paths]
+
+    def store(self, rows: list) -> None:
+        """Добавляет или обновляет записи (путь, mtime_ns, размер, ширина, высота, площадь, формат, sha256)"""
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO images ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows
+            )
+
+    def attach(self, df: pd.DataFrame, path_column: str = 'absolute_path', workers: int = DEFAULT_WORKERS,
+               on_error: Optional[Callable[[str, Exception], None]] = None) -> pd.DataFrame:
+        """
+        Добавляет к df колонки width, height, image_area, format и sha256.
+
+        Актуальные значения берутся из кэша, остальные файлы читаются в
+        пуле потоков и записываются в кэш. Для нечитаемых файлов ширина и
+        высота равны -1, а ошибка передается в on_error(путь, исключение).
+        """
+        paths = df[path_column].tolist()
+        entries = self.lookup(paths)
+        # Запись актуальна, если файл с тех пор не менялся (и хэш посчитан, если он нужен)
+        fresh = np.fromiter(
+            (entry is not None and entry[:2] == file_stamp(path) and (not self.hash_content or entry[6] is not None)
+             for path, entry in zip(paths, entries)),
+            dtype=bool, count=len(paths)
+        )
+        widths = np.fromiter((entry[2] if entry else -1 for entry in entries), dtype=np.int64, count=len(paths))
+        heights = np.fromiter((entry[3] if entry else -1 for entry in entries), dtype=np.int64, count=len(paths))
+        formats = np.array([entry[5] if entry else None for entry in entries], dtype=object)
+        hashes = np.array([entry[6] if entry else None for entry in entries], dtype=object)
+
+        stale = np.flatnonzero(~fresh)
+        stale_paths = [paths[i] for i in stale]
+        probe = partial(probe_file, hash_content=self.hash_content)
+        rows = []
+        for i, path, info in zip(stale, stale_paths, map_paths(probe, stale_paths, workers, on_error)):
+            if info is None:
+                widths[i] = heights[i] = -1
+                formats[i] = hashes[i] = None
+                continue
+            rows.append((path,) + info)
+            widths[i], heights[i], formats[i], hashes[i] = info[2], info[3], info[5], info[6]
+        if rows:
+            self.store(rows)
+
+        df['width'] = widths
+        df['height'] = heights
+        df['image_area'] = np.where(widths < 0, 0, widths * heights)
+        df['format'] = formats
+        df['sha256'] = hashes
+        return df
@@ -1,61 +1,95 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import os
-from PIL import Image
 import argparse
+import os
+
+from lab_metrics import METRICS, add_arguments, instrumented
+
+
+# Переименование колонок аннотации для лучшей читаемости
+COLUMN_NAMES = {
+    'Абсолютный путь': 'absolute_path',
+    'Относительный путь': 'relative_path'
+}
+
+
+def report_error(path, e):
+    """Сообщение о файле, размеры которого не удалось прочитать"""
+    print(f"Ошибка при обработке {path}: {e}")
 
 
-def create_dataframe_from_csv(csv_file):
-    """Создание DataFrame из CSV файла"""
-    df = pd.read_csv(csv_file, encoding='utf-8')
+def create_dataframe_from_csv(csv_file, cache_path=None, workers=16, hash_content=False):
+    """
+    Создание DataFrame из CSV файла.
+
+    С cache_path к строкам добавляются размеры, формат и (с hash_content)
+    хэш изображений из кэша метаданных; читаются только новые и измененные файлы.
+    """
+    import pandas as pd
+
+    with METRICS.stage('read', bytes_read=os.path.getsize(csv_file)) as timer:
+        df = pd.read_csv(csv_file, encoding='utf-8')
+        timer.items = len(df)
     
-    # Переименовываем колонки для лучшей читаемости
-    df = df.rename(columns={
-        'Абсолютный путь': 'absolute_path',
-        'Относительный путь': 'relative_path'
-    })
+    df = df.rename(columns=COLUMN_NAMES)
+
+    if cache_path is not None:
+        from lab4_metadata import MetadataCache
+
+        with MetadataCache(cache_path, hash_content) as cache:
+            df = cache.attach(df, workers=workers, on_error=report_error)
     
     return df
 
 
-def add_image_area_column(df):
+# Границы категорий площади: категория i - площади из [AREA_BINS[i-1], AREA_BINS[i])
+AREA_BINS = [10000, 50000, 100000, 500000, 1000000]
+UNKNOWN_CATEGORY = "Unknown"
+
+
+def format_area(value):
+    """Короткая запись площади: 10000 -> 10k, 1000000 -> 1M"""
+    if value >= 1000000 and value % 100000 == 0:
+        return f"{value / 1000000:g}M"
+    if value >= 1000 and value % 100 == 0:
+        return f"{value / 1000:g}k"
+    return str(value)
+
+
+def area_labels(bins=AREA_BINS):
+    """Названия категорий для границ bins, включая Unknown"""
+    edges = [0] + list(bins)
+    labels = [f"{format_area(low)}-{format_area(high)}" for low, high in zip(edges, edges[1:])]
+    return labels + [f">{format_area(edges[-1])}", UNKNOWN_CATEGORY]
+
+
+def categorize_areas(areas, failed, bins=AREA_BINS):
+    """Категории площадей одним проходом np.searchsorted в виде pd.Categorical"""
+    import numpy as np
+    import pandas as pd
+
+    labels = area_labels(bins)
+    codes = np.searchsorted(np.asarray(bins), areas, side='right')
+    codes[failed] = len(labels) - 1
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+def add_image_area_column(df, workers=16, bins=AREA_BINS):
     """Добавление колонки с площадью изображений и категориями для гистограммы"""
-    
-    areas = []
-    area_ranges = []
-    
-    for _, row in df.iterrows():
-        try:
-            # Пытаемся открыть изображение
-            img = Image.open(row['absolute_path'])
-            width, height = img.size
-            area = width * height
-            
-            # Определяем категорию площади
-            if area < 10000:
-                category = "0-10k"
-            elif area < 50000:
-                category = "10k-50k"
-            elif area < 100000:
-                category = "50k-100k"
-            elif area < 500000:
-                category = "100k-500k"
-            elif area < 1000000:
-                category = "500k-1M"
-            else:
-                category = ">1M"
-            
-            areas.append(area)
-            area_ranges.append(category)
-            
-        except Exception as e:
-            # Если не удалось открыть изображение, ставим значения по умолчанию
-            print(f"Ошибка при обработке {row['absolute_path']}: {e}")
-            areas.append(0)
-            area_ranges.append("Unknown")
-    
+    import numpy as np
+
+    if 'width' in df.columns:
+        # Размеры уже добавлены из кэша метаданных
+        widths, heights = df['width'].to_numpy(), df['height'].to_numpy()
+    else:
+        from lab4_dimensions import read_dimensions
+
+        # Размеры читаются из заголовков файлов, без декодирования изображений
+        widths, heights = read_dimensions(df['absolute_path'].tolist(), workers=workers, on_error=report_error)
+    # Если не удалось прочитать размеры, ставим значения по умолчанию
+    failed = widths < 0
+    areas = np.where(failed, 0, widths * heights)
+
     df['image_area'] = areas
-    df['area_category'] = area_ranges
+    df['area_category'] = categorize_areas(areas, failed, bins)
     
     return df
 
@@ -65,25 +99,33 @@ def sort_by_area(df, ascending=True):
     return df.sort_values(by='image_area', ascending=ascending)
 
 
+def drop_metadata_columns(df):
+    """Убирает колонки кэша метаданных, чтобы состав выходного CSV не зависел от --cache"""
+    from lab4_metadata import METADATA_COLUMNS
+
+    return df.drop(columns=METADATA_COLUMNS, errors='ignore')
+
+
 def filter_by_area(df, min_area=0, max_area=float('inf')):
     """Фильтрация DataFrame по диапазону площадей"""
-    return df[(df['image_area'] >= min_area) & (df['image_area'] <= max_area)]
+    areas = df['image_area'].to_numpy()
+    return df[(areas >= min_area) & (areas <= max_area)]
+
 
+def count_by_category(df):
+    """Количество файлов в каждой категории (включая пустые) за один проход"""
+    return df['area_category'].value_counts(sort=False)
 
-def plot_area_histogram(df):
+
+def plot_area_histogram(df, counts=None):
     """Построение гистограммы распределения площадей"""
-    
-    # Подготовка данных для гистограммы
-    categories = [
-        "0-10k", "10k-50k", "50k-100k", 
-        "100k-500k", "500k-1M", ">1M", "Unknown"
-    ]
+    import matplotlib.pyplot as plt
     
     # Считаем количество файлов в каждой категории
-    counts = []
-    for category in categories:
-        count = len(df[df['area_category'] == category])
-        counts.append(count)
+    if counts is None:
+        counts = count_by_category(df)
+    categories = counts.index.astype(str).tolist()
+    counts = counts.tolist()
     
     # Создаем график
     plt.figure(figsize=(12, 6))
@@ -106,6 +148,52 @@ def plot_area_histogram(df):
     return plt
 
 
+def use_headless_backend():
+    """Неинтерактивный backend matplotlib: график только сохраняется в файл"""
+    import matplotlib
+
+    matplotlib.use('Agg')
+
+
+def analyze_in_chunks(args, cache_path):
+    """Те же шаги анализа, что и в main, но с чтением CSV частями и ограниченной памятью"""
+    from lab4_chunked import ChunkedAnalysis
+
+    print(f"1-4. Анализ CSV частями по {args.chunk_size} строк...")
+    analysis = ChunkedAnalysis(bins=sorted(args.bins), min_area=50000, max_area=500000,
+                               cache_path=cache_path, hash_content=args.hash)
+    analysis.run(args.csv, args.output_csv, args.chunk_size,
+                 filtered_csv=args.filtered_csv, sorted_csv=args.sorted_csv)
+    print(f"   Загружено {analysis.rows} записей")
+    print(f"   DataFrame сохранен в {args.output_csv}")
+    print(f"   Первые 5 значений площадей: {analysis.smallest.tolist()}")
+    print(f"   Найдено {analysis.filtered} файлов в диапазоне от 50000 до 500000")
+    if args.filtered_csv:
+        print(f"   Отфильтрованные строки сохранены в {args.filtered_csv}")
+    if args.sorted_csv:
+        print(f"   Отсортированные строки сохранены в {args.sorted_csv}")
+
+    print("\n5. Построение гистограммы...")
+    with METRICS.stage('plot'):
+        plt = plot_area_histogram(None, analysis.counts)
+
+    print("\n6. Сохранение результатов...")
+    with METRICS.stage('write') as timer:
+        plt.savefig(args.output_plot, dpi=300, bbox_inches='tight')
+        timer.bytes_written = os.path.getsize(args.output_plot)
+    print(f"   График сохранен в {args.output_plot}")
+
+    print("\n7. Статистика по категориям:")
+    for category, count in analysis.counts.items():
+        if count:
+            print(f"   {category}: {count} файлов")
+
+    if not args.no_show:
+        plt.show()
+
+    print("\nАнализ завершен!")
+
+
 def main():
     parser = argparse.ArgumentParser(description='Анализ данных изображений')
     parser.add_argument('--csv', required=True, help='CSV файл аннотации')
@@ -113,15 +201,47 @@ def main():
                        help='Файл для сохранения DataFrame')
     parser.add_argument('--output_plot', default='area_distribution.png',
                        help='Файл для сохранения графика')
+    parser.add_argument('--bins', type=int, nargs='+', default=AREA_BINS,
+                       help='Границы категорий площади (по возрастанию)')
+    parser.add_argument('--cache', nargs='?', const='', default=None,
+                       help='Кэшировать метаданные изображений в SQLite (по умолчанию .image_metadata.sqlite рядом с CSV)')
+    parser.add_argument('--hash', action='store_true',
+                       help='Хранить в кэше SHA-256 изображений (читает файлы целиком)')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                       help='Анализировать CSV частями по указанному числу строк (для очень больших аннотаций)')
+    parser.add_argument('--filtered_csv', default=None,
+                       help='Файл для отфильтрованных строк (в режиме --chunk-size)')
+    parser.add_argument('--sorted_csv', default=None,
+                       help='Файл для строк, отсортированных по площади (в режиме --chunk-size)')
+    parser.add_argument('--no-show', action='store_true',
+                       help='Не открывать окно с графиком (для запуска без дисплея)')
+    add_arguments(parser)
     
     args = parser.parse_args()
-    
+    if args.no_show:
+        use_headless_backend()
+
+    with instrumented(args):
+        run_analysis(args)
+
+
+def run_analysis(args):
+    """Шаги анализа по аргументам командной строки"""
+    cache_path = None
+    if args.cache is not None:
+        from lab4_metadata import DEFAULT_CACHE_NAME
+
+        cache_path = args.cache or os.path.join(os.path.dirname(os.path.abspath(args.csv)), DEFAULT_CACHE_NAME)
+    if args.chunk_size:
+        analyze_in_chunks(args, cache_path)
+        return
+
     print("1. Создание DataFrame...")
-    df = create_dataframe_from_csv(args.csv)
+    df = create_dataframe_from_csv(args.csv, cache_path, hash_content=args.hash)
     print(f"   Загружено {len(df)} записей")
     
     print("\n2. Добавление колонки с площадью изображений...")
-    df = add_image_area_column(df)
+    df = add_image_area_column(df, bins=sorted(args.bins))
     print(f"   Добавлены колонки: image_area, area_category")
     
     print("\n3. Сортировка данных по площади...")
@@ -133,24 +253,31 @@ def main():
     print(f"   Найдено {len(filtered_df)} файлов в заданном диапазоне")
     
     print("\n5. Построение гистограммы...")
-    plt = plot_area_histogram(df)
+    counts = count_by_category(df)
+    with METRICS.stage('plot'):
+        plt = plot_area_histogram(df, counts)
     
     print("\n6. Сохранение результатов...")
     # Сохраняем DataFrame
-    df.to_csv(args.output_csv, index=False, encoding='utf-8')
+    with METRICS.stage('write', items=len(df)) as timer:
+        drop_metadata_columns(df).to_csv(args.output_csv, index=False, encoding='utf-8')
+        timer.bytes_written = os.path.getsize(args.output_csv)
     print(f"   DataFrame сохранен в {args.output_csv}")
     
     # Сохраняем график
-    plt.savefig(args.output_plot, dpi=300, bbox_inches='tight')
+    with METRICS.stage('write') as timer:
+        plt.savefig(args.output_plot, dpi=300, bbox_inches='tight')
+        timer.bytes_written = os.path.getsize(args.output_plot)
     print(f"   График сохранен в {args.output_plot}")
     
     print("\n7. Статистика по категориям:")
-    for category in df['area_category'].unique():
-        count = len(df[df['area_category'] == category])
-        print(f"   {category}: {count} файлов")
+    for category, count in counts.items():
+        if count:
+            print(f"   {category}: {count} файлов")
     
-    # Показываем график
-    plt.show()
+    # Показываем график, если не запрошен режим без окна
+    if not args.no_show:
+        plt.show()
     
     print("\nАнализ завершен!")
 
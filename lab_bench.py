@@ -0,0 +1,321 @@
+import argparse
+import contextlib
+import csv
+import importlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+
+
+DEFAULT_WORKDIR = 'bench_data'
+# История замеров хранится в рабочей папке рядом с данными
+HISTORY_NAME = 'bench_history.json'
+
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Волков', 'Соколов']
+FIRST_NAMES = ['Алексей', 'Мария', 'дмитрий', 'Анна', 'Андрей', 'Ольга', 'Сергей', 'Елена']
+GENDERS = ['Мужской', 'Женский', 'м', 'ж']
+CITIES = ['Москва', 'Санкт-Петербург', 'г. Новосибирск', 'Екатеринбург', 'г. Казань', 'Самара']
+# Все три формата даты из data.txt
+DATE_SEPARATORS = ['.', '-', '/']
+
+
+def generate_profiles(path: str, count: int, seed: int = 0) -> None:
+    """Файл анкет в формате data.txt: count анкет с датами во всех трех форматах"""
+    rng = random.Random(seed)
+    first_day = date(1940, 1, 1).toordinal()
+    last_day = date(2010, 12, 31).toordinal()
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(count):
+            birth = date.fromordinal(rng.randint(first_day, last_day))
+            separator = DATE_SEPARATORS[i % len(DATE_SEPARATORS)]
+            f.write(
+                f"{i + 1})\n"
+                f"Фамилия: {rng.choice(LAST_NAMES)}\n"
+                f"Имя: {rng.choice(FIRST_NAMES)}\n"
+                f"Пол: {rng.choice(GENDERS)}\n"
+                f"Дата рождения: {birth.day:02d}{separator}{birth.month:02d}{separator}{birth.year}\n"
+                f"Номер телефона или email: +7 9{rng.randint(0, 99):02d} {rng.randint(0, 9999999):07d}\n"
+                f"Город: {rng.choice(CITIES)}\n\n"
+            )
+
+
+def generate_images(folder: str, count: int, width: int, height: int, image_format: str = 'jpg',
+                    seed: int = 0) -> List[str]:
+    """count изображений width x height в формате image_format: градиент с шумом"""
+    import cv2
+    import numpy as np
+
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:height, 0:width]
+    paths = []
+    for i in range(count):
+        # Плавный фон сжимается как фотография, шум не дает ему выродиться
+        base = (xs * rng.uniform(0.1, 1.0) + ys * rng.uniform(0.1, 1.0)) % 256
+        noise = rng.integers(0, 32, size=(height, width, 3))
+        img = (base[..., None] + noise).astype(np.uint8)
+        path = os.path.join(folder, f"{i:06d}.{image_format}")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+def generate_annotation(csv_file: str, image_paths: List[str], rows: int) -> None:
+    """CSV аннотации как у lab2_var4 длиной rows строк (пути повторяются по кругу)"""
+    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Абсолютный путь', 'Относительный путь'])
+        for i in range(rows):
+            path = image_paths[i % len(image_paths)]
+            writer.writerow([os.path.abspath(path), path])
+
+
+def bench_people(path: str) -> Tuple[int, dict]:
+    from lab1_var4 import find_oldest_and_youngest, read_people_from_file
+
+    people = read_people_from_file(path)
+    oldest, youngest = find_oldest_and_youngest(people)
+    return len(people), {'oldest': oldest.birth_date, 'youngest': youngest.birth_date}
+
+
+def bench_rotate(path: str, angle: float, rotations: int) -> Tuple[int, dict]:
+    import cv2
+
+    from lab3_var4 import rotate_image
+
+    img = cv2.imread(path)
+    for _ in range(rotations):
+        rotated = rotate_image(img, angle)
+    return rotations, {'shape': list(rotated.shape)}
+
+
+def bench_rotate_folder(input_folder: str, output_folder: str, angle: float,
+                        workers: Optional[int]) -> Tuple[int, dict]:
+    from lab3_var4 import process_folder
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        process_folder(input_folder, output_folder, angle, workers=workers)
+    outputs = len(os.listdir(output_folder))
+    return outputs, {'outputs': outputs}
+
+
+def bench_image_iterator(csv_file: str, shuffle: bool) -> Tuple[int, dict]:
+    from lab2_var4 import ImageIterator
+
+    count = 0
+    with ImageIterator(csv_file, shuffle=shuffle) as iterator:
+        for _ in iterator:
+            count += 1
+    return count, {'rows': count}
+
+
+def bench_image_areas(csv_file: str) -> Tuple[int, dict]:
+    from lab4_var4 import add_image_area_column, create_dataframe_from_csv
+
+    df = add_image_area_column(create_dataframe_from_csv(csv_file))
+    return len(df), {'total_area': int(df['image_area'].sum())}
+
+
+CASES = {
+    'lab1_people': bench_people,
+    'lab3_rotate': bench_rotate,
+    'lab3_folder': bench_rotate_folder,
+    'lab2_iterator': bench_image_iterator,
+    'lab4_areas': bench_image_areas,
+}
+# Модули, импортируемые до замера, чтобы время импорта не попадало в результат
+CASE_IMPORTS = {
+    'lab1_people': ['lab1_var4'],
+    'lab3_rotate': ['cv2', 'lab3_var4'],
+    'lab3_folder': ['cv2', 'lab3_var4', 'lab3_pipeline'],
+    'lab2_iterator': ['lab2_var4'],
+    'lab4_areas': ['numpy', 'pandas', 'lab4_var4', 'lab4_dimensions'],
+}
+
+
+def peak_rss_mb() -> float:
+    """
+    Пиковая память процесса в МБ.
+
+    На Linux берется VmHWM: ru_maxrss наследуется через fork и exec и
+    показал бы пик родительского процесса. Где нет ни /proc, ни модуля
+    resource (Windows), возвращает 0.
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS возвращает байты, Linux - килобайты
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(case: str, params: dict, repeat: int) -> dict:
+    """Лучшее время из repeat запусков и пиковая память процесса (выполняется в отдельном процессе)"""
+    for module in CASE_IMPORTS[case]:
+        importlib.import_module(module)
+    best = float('inf')
+    items, result = 0, {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items, result = CASES[case](**params)
+        best = min(best, time.perf_counter() - start)
+    return {
+        'seconds': best,
+        'items': items,
+        'items_per_second': items / best if best else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'result': result,
+    }
+
+
+def run_case(case: str, scale: str, params: dict, repeat: int) -> dict:
+    """
+    Запускает замер в новом процессе (spawn), чтобы пиковая память
+    и импорты одного замера не влияли на другие.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        record = pool.submit(measure, case, params, repeat).result()
+    record.update({'case': case, 'scale': scale})
+    print(f"{case:14} {scale:>16}: {record['seconds']:8.3f} с, {record['items_per_second']:10.1f} эл./с, "
+          f"пик {record['peak_rss_mb']:7.1f} МБ")
+    return record
+
+
+def plan_cases(args, workdir: str) -> List[Tuple[str, str, dict]]:
+    """Генерирует данные (детерминированно по seed) и возвращает список замеров"""
+    cases = []
+    if 'lab1' in args.labs:
+        for count in args.profiles:
+            path = os.path.join(workdir, f"profiles_{count}_seed{args.seed}.txt")
+            if not os.path.exists(path):
+                generate_profiles(path, count, args.seed)
+            cases.append(('lab1_people', str(count), {'path': path}))
+
+    image_folders: Dict[str, List[str]] = {}
+    if {'lab2', 'lab3', 'lab4'} & set(args.labs):
+        for resolution in args.resolutions:
+            width, height = (int(value) for value in resolution.lower().split('x'))
+            folder = os.path.join(workdir, f"images_{resolution}_{args.format}_seed{args.seed}")
+            paths = sorted(os.path.join(folder, name) for name in os.listdir(folder)) if os.path.isdir(folder) else []
+            if len(paths) != args.images:
+                paths = generate_images(folder, args.images, width, height, args.format, args.seed)
+            image_folders[resolution] = paths
+
+    if 'lab3' in args.labs:
+        for resolution, paths in image_folders.items():
+            cases.append(('lab3_rotate', resolution, {'path': paths[0], 'angle': args.angle, 'rotations': 10}))
+            output = os.path.join(workdir, f"rotated_{resolution}_{args.format}")
+            cases.append(('lab3_folder', f"{resolution}x{len(paths)}", {
+                'input_folder': os.path.dirname(paths[0]), 'output_folder': output,
+                'angle': args.angle, 'workers': args.workers,
+            }))
+
+    if {'lab2', 'lab4'} & set(args.labs):
+        paths = next(iter(image_folders.values()))
+        for rows in args.rows:
+            csv_file = os.path.join(workdir, f"annotation_{rows}.csv")
+            generate_annotation(csv_file, paths, rows)
+            if 'lab2' in args.labs:
+                cases.append(('lab2_iterator', str(rows), {'csv_file': csv_file, 'shuffle': False}))
+                cases.append(('lab2_iterator', f"{rows}-shuffle", {'csv_file': csv_file, 'shuffle': True}))
+            if 'lab4' in args.labs:
+                cases.append(('lab4_areas', str(rows), {'csv_file': csv_file}))
+    return cases
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_history(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(previous: dict, current: dict) -> None:
+    """Печатает изменение скорости и памяти относительно предыдущего запуска"""
+    before = {(record['case'], record['scale']): record for record in previous['results']}
+    print(f"\nСравнение с запуском {previous['timestamp']} ({previous.get('commit') or '?'}):")
+    for record in current['results']:
+        old = before.get((record['case'], record['scale']))
+        if old is None:
+            continue
+        speedup = old['seconds'] / record['seconds'] if record['seconds'] else float('inf')
+        changed = '' if old['result'] == record['result'] else '  (результат изменился!)'
+        print(f"   {record['case']:14} {record['scale']:>16}: x{speedup:5.2f} по времени, "
+              f"{record['peak_rss_mb'] - old['peak_rss_mb']:+7.1f} МБ{changed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры производительности лабораторных на синтетических данных')
+    parser.add_argument('--labs', nargs='+', default=['lab1', 'lab2', 'lab3', 'lab4'],
+                        choices=['lab1', 'lab2', 'lab3', 'lab4'], help='Какие лабораторные замерять')
+    parser.add_argument('--profiles', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Размеры файлов анкет для lab1')
+    parser.add_argument('--resolutions', nargs='+', default=['640x480', '1920x1080'],
+                        help='Разрешения изображений (ШxВ)')
+    parser.add_argument('--images', type=int, default=20, help='Изображений в каждой папке')
+    parser.add_argument('--format', default='jpg', help='Формат изображений (расширение)')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000],
+                        help='Длины CSV аннотаций для lab2 и lab4')
+    parser.add_argument('--angle', type=float, default=33.0, help='Угол поворота для lab3')
+    parser.add_argument('--workers', type=int, default=None, help='Потоков для process_folder')
+    parser.add_argument('--repeat', type=int, default=3, help='Повторов каждого замера, берется лучший')
+    parser.add_argument('--seed', type=int, default=0, help='Seed генераторов данных')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help='Папка для сгенерированных данных')
+    parser.add_argument('--history', default=None,
+                        help=f'JSON с историей замеров (по умолчанию {HISTORY_NAME} в --workdir)')
+    args = parser.parse_args()
+    if args.history is None:
+        args.history = os.path.join(args.workdir, HISTORY_NAME)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    print("Подготовка данных...")
+    cases = plan_cases(args, args.workdir)
+
+    print(f"Замеры (лучший из {args.repeat}):")
+    results = [run_case(case, scale, params, args.repeat) for case, scale, params in cases]
+
+    run = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': args.seed,
+        'results': results,
+    }
+    history = load_history(args.history)
+    if history:
+        compare(history[-1], run)
+    history.append(run)
+    with open(args.history, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты добавлены в {args.history}")
+
+
+if __name__ == "__main__":
+    main()
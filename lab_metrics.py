@@ -0,0 +1,264 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+# Верхние границы корзин гистограмм (последняя корзина - +Inf)
+LATENCY_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0]
+BYTES_BUCKETS = [1 << 10, 1 << 14, 1 << 16, 1 << 18, 1 << 20, 1 << 22, 1 << 24, 1 << 26]
+PROFILE_TOP = 25
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, как в Prometheus"""
+
+    __slots__ = ('bounds', 'counts', 'total')
+
+    def __init__(self, bounds: List[float]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def cumulative(self) -> List[int]:
+        """Накопленные счетчики по корзинам (значения <= границы)"""
+        result, running = [], 0
+        for count in self.counts:
+            running += count
+            result.append(running)
+        return result
+
+    def to_dict(self) -> dict:
+        labels = [str(bound) for bound in self.bounds] + ['+Inf']
+        return {'sum': self.total, 'buckets': dict(zip(labels, self.cumulative()))}
+
+
+class StageStats:
+    """Накопленные замеры одной стадии: число вызовов, элементы, время и байты"""
+
+    __slots__ = ('calls', 'items', 'latency', 'bytes_read', 'bytes_written')
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.items = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.bytes_read = Histogram(BYTES_BUCKETS)
+        self.bytes_written = Histogram(BYTES_BUCKETS)
+
+
+class StageTimer:
+    """Замер одного вызова стадии; байты и число элементов можно задать внутри with"""
+
+    __slots__ = ('metrics', 'name', 'start', 'items', 'bytes_read', 'bytes_written')
+
+    def __init__(self, metrics: 'Metrics', name: str, items: int, bytes_read: int, bytes_written: int) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.items = items
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+
+    def __enter__(self) -> 'StageTimer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            # Неудачный вызов не попадает в гистограммы, только в счетчик ошибок стадии
+            self.metrics.count(f"{self.name}_errors")
+            return
+        self.metrics.observe(self.name, time.perf_counter() - self.start, self.items,
+                             self.bytes_read, self.bytes_written)
+
+
+class NullTimer:
+    """Замер-заглушка для выключенных метрик: ничего не считает"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> 'NullTimer':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def __setattr__(self, name: str, value) -> None:
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    """
+    Метрики стадий обработки (read, parse, decode, rotate, encode, probe, plot...).
+
+    По умолчанию выключены: stage() возвращает общую заглушку, и в горячем
+    пути остается одна проверка флага. Включенные метрики потокобезопасны
+    и выгружаются в JSON lines или текстовый формат Prometheus.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.stages: Dict[str, StageStats] = {}
+        self.counters: Dict[str, int] = {}
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def stage(self, name: str, items: int = 1, bytes_read: int = 0, bytes_written: int = 0):
+        """Контекстный менеджер замера одного вызова стадии name"""
+        if not self.enabled:
+            return NULL_TIMER
+        return StageTimer(self, name, items, bytes_read, bytes_written)
+
+    def observe(self, name: str, seconds: float, items: int = 1, bytes_read: int = 0, bytes_written: int = 0) -> None:
+        """Добавляет готовый замер стадии: время вызова, число элементов и байты"""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.calls += 1
+            stats.items += items
+            stats.latency.observe(seconds)
+            if bytes_read:
+                stats.bytes_read.observe(bytes_read)
+            if bytes_written:
+                stats.bytes_written.observe(bytes_written)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Увеличивает счетчик события name"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def records(self) -> List[dict]:
+        """Все метрики как список словарей (по одному на стадию и счетчик)"""
+        with self._lock:
+            records = [
+                {
+                    'type': 'stage', 'stage': name, 'calls': stats.calls, 'items': stats.items,
+                    'seconds': stats.latency.to_dict(),
+                    'bytes_read': stats.bytes_read.to_dict(),
+                    'bytes_written': stats.bytes_written.to_dict(),
+                }
+                for name, stats in self.stages.items()
+            ]
+            records.extend({'type': 'counter', 'name': name, 'value': value} for name, value in self.counters.items())
+        return records
+
+    def to_jsonl(self) -> str:
+        import json
+
+        timestamp = time.time()
+        script = os.path.basename(sys.argv[0])
+        return ''.join(
+            json.dumps(dict(record, timestamp=timestamp, script=script), ensure_ascii=False) + '\n'
+            for record in self.records()
+        )
+
+    def to_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines = []
+        with self._lock:
+            histograms = [
+                ('lab_stage_seconds', 'Время одного вызова стадии', lambda stats: stats.latency),
+                ('lab_stage_bytes_read', 'Прочитано байт за вызов стадии', lambda stats: stats.bytes_read),
+                ('lab_stage_bytes_written', 'Записано байт за вызов стадии', lambda stats: stats.bytes_written),
+            ]
+            for metric, help_text, select in histograms:
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+                for name, stats in self.stages.items():
+                    histogram = select(stats)
+                    for bound, count in zip(histogram.bounds + ['+Inf'], histogram.cumulative()):
+                        lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {count}')
+                    lines.append(f'{metric}_sum{{stage="{name}"}} {histogram.total}')
+                    lines.append(f'{metric}_count{{stage="{name}"}} {histogram.cumulative()[-1]}')
+            lines += ["# HELP lab_stage_items_total Обработано элементов стадией", "# TYPE lab_stage_items_total counter"]
+            lines += [f'lab_stage_items_total{{stage="{name}"}} {stats.items}' for name, stats in self.stages.items()]
+            lines += ["# HELP lab_events_total Счетчики событий", "# TYPE lab_events_total counter"]
+            lines += [f'lab_events_total{{name="{name}"}} {value}' for name, value in self.counters.items()]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        """Сохраняет метрики: .prom/.txt - формат Prometheus, иначе дописывает JSON lines"""
+        if path.endswith(('.prom', '.txt')):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus())
+        else:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(self.to_jsonl())
+
+    def summary(self) -> str:
+        """Короткая таблица стадий для вывода в консоль"""
+        lines = []
+        for name, stats in sorted(self.stages.items(), key=lambda item: -item[1].latency.total):
+            rate = stats.items / stats.latency.total if stats.latency.total else 0.0
+            lines.append(f"   {name:10} {stats.latency.total:9.3f} с  {stats.calls:8} вызовов  "
+                         f"{stats.items:8} эл. ({rate:.1f} эл./с)")
+        return '\n'.join(lines)
+
+
+METRICS = Metrics()
+
+
+def add_arguments(parser) -> None:
+    """Добавляет в argparse общие флаги --metrics и --profile"""
+    parser.add_argument('--metrics', default=None,
+                        help='Сохранить метрики стадий (.prom - формат Prometheus, иначе JSON lines)')
+    parser.add_argument('--profile', choices=['cpu', 'memory'], default=None,
+                        help='Профилировать запуск: cpu - cProfile, memory - tracemalloc')
+
+
+@contextmanager
+def instrumented(args):
+    """
+    Включает метрики и профилирование по флагам --metrics и --profile на
+    время блока, а после него сохраняет метрики и печатает отчет профиля.
+    """
+    if args.metrics:
+        METRICS.enable()
+    profiler = None
+    if args.profile == 'cpu':
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif args.profile == 'memory':
+        import tracemalloc
+
+        tracemalloc.start()
+    try:
+        yield METRICS
+    finally:
+        if profiler is not None:
+            import pstats
+
+            profiler.disable()
+            print(f"\nПрофиль CPU (топ {PROFILE_TOP} по суммарному времени):")
+            pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        elif args.profile == 'memory':
+            import tracemalloc
+
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"\nПамять: сейчас {current / (1 << 20):.1f} МБ, пик {peak / (1 << 20):.1f} МБ")
+            print(f"Топ {PROFILE_TOP} мест выделения памяти:")
+            for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+                print(f"   {stat}")
+        if args.metrics:
+            METRICS.write(args.metrics)
+            print(f"\nМетрики стадий (сохранены в {args.metrics}):")
+            print(METRICS.summary())
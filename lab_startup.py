@@ -0,0 +1,67 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+
+DEFAULT_SCRIPTS = ['lab2_var4.py', 'lab3_var4.py', 'lab4_var4.py']
+# Строка вывода -X importtime: "import time: self [us] | cumulative | imported package"
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int]]:
+    """Модули верхнего уровня и их суммарное время импорта (мкс) из вывода -X importtime"""
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        # Вложенные импорты выводятся с отступом больше одного пробела
+        if match and len(match.group(3)) == 1:
+            imports.append((match.group(4), int(match.group(2))))
+    return imports
+
+
+def measure_startup(script: str, script_args: List[str], runs: int = 3) -> Tuple[float, List[Tuple[str, int]]]:
+    """
+    Запускает скрипт с -X importtime runs раз; возвращает лучшее время
+    запуска в секундах и импорты самого быстрого запуска.
+    """
+    best_time = float('inf')
+    best_imports: List[Tuple[str, int]] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', script] + script_args,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        elapsed = time.perf_counter() - start
+        if elapsed < best_time:
+            best_time = elapsed
+            best_imports = parse_importtime(result.stderr)
+    return best_time, best_imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Отчет о времени запуска скриптов лабораторных')
+    parser.add_argument('scripts', nargs='*', default=DEFAULT_SCRIPTS,
+                        help='Скрипты для проверки (по умолчанию lab2_var4.py, lab3_var4.py, lab4_var4.py)')
+    parser.add_argument('--args', default='--help',
+                        help='Аргументы запуска скриптов (по умолчанию --help)')
+    parser.add_argument('--runs', type=int, default=3, help='Число запусков, берется лучший')
+    parser.add_argument('--top', type=int, default=5, help='Сколько самых долгих импортов показать')
+    args = parser.parse_args()
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for script in args.scripts:
+        path = script if os.path.exists(script) else os.path.join(folder, script)
+        elapsed, imports = measure_startup(path, args.args.split(), args.runs)
+        total = sum(cumulative for _, cumulative in imports)
+        print(f"{script} {args.args}: запуск {elapsed * 1000:.0f} мс, импорты {total / 1000:.0f} мс")
+        for module, cumulative in sorted(imports, key=lambda item: -item[1])[:args.top]:
+            print(f"   {cumulative / 1000:8.1f} мс  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import argparse
+import csv
+import os
+import threading
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from lab_metrics import METRICS, add_arguments, instrumented
+
+
+ANNOTATION_HEADER = ['Абсолютный путь', 'Относительный путь']
+# Колонки те же, что в CSV анализа lab4_var4
+ANALYSIS_HEADER = ['absolute_path', 'relative_path', 'image_area', 'area_category']
+
+
+def read_annotation(csv_file: str) -> Iterator[Tuple[str, str]]:
+    """Строки (абсолютный путь, относительный путь) CSV аннотации по одной"""
+    with open(csv_file, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if row:
+                yield row[0], row[1] if len(row) > 1 else row[0]
+
+
+def annotate_folder(folder: str, csv_file: str, validate: bool = False,
+                    max_distance: int = 5) -> Iterator[Tuple[str, str]]:
+    """
+    Строки аннотации для изображений папки; каждая строка записывается в
+    csv_file в момент, когда уходит дальше по конвейеру. Файлы выбираются
+    так же, как в lab2_var4. С validate они еще и проверяются, как в
+    lab2_var4, до начала конвейера: для хэша каждый файл декодируется
+    лишний раз.
+    """
+    from lab2_var4 import find_image_files, validate_files
+
+    image_files = find_image_files(folder)
+    if validate:
+        image_files = validate_files(image_files, max_distance)
+
+    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(ANNOTATION_HEADER)
+        for img_path in image_files:
+            row = (str(img_path.absolute()), str(img_path))
+            writer.writerow(row)
+            yield row
+
+
+class StreamAnalysis:
+    """
+    Строки анализа lab4 по размерам из уже декодированных изображений.
+
+    Размеры приходят из потоков чтения в произвольном порядке, а строки
+    пишутся в output_csv в порядке аннотации, как только готов очередной
+    префикс, поэтому в памяти держатся только строки, находящиеся в
+    конвейере. Для нечитаемых файлов площадь 0 и категория Unknown.
+    """
+
+    def __init__(self, output_csv: str, bins: Optional[List[int]] = None) -> None:
+        from lab4_var4 import AREA_BINS, area_labels
+
+        self.bins = sorted(bins or AREA_BINS)
+        self.labels = area_labels(self.bins)
+        self.counts = [0] * len(self.labels)
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._pending: Dict[int, list] = {}
+        self._next = 0
+        self._file = open(output_csv, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file, lineterminator='\n')
+        self._writer.writerow(ANALYSIS_HEADER)
+
+    def add(self, index: int, absolute_path: str, relative_path: str) -> None:
+        """Регистрирует строку аннотации до того, как файл уйдет на чтение"""
+        with self._lock:
+            self._pending[index] = [absolute_path, relative_path, None]
+
+    def decoded(self, index: int, path: str, img) -> None:
+        """Размеры декодированного изображения (None - файл не прочитан)"""
+        with self._lock:
+            self._pending[index][2] = img.shape[:2] if img is not None else ()
+            self._flush()
+
+    def _flush(self, force: bool = False) -> None:
+        while self._next in self._pending and (force or self._pending[self._next][2] is not None):
+            absolute_path, relative_path, shape = self._pending.pop(self._next)
+            if shape:
+                area = shape[0] * shape[1]
+                code = bisect_right(self.bins, area)
+            else:
+                area = 0
+                code = len(self.labels) - 1
+            self.counts[code] += 1
+            self._writer.writerow([absolute_path, relative_path, area, self.labels[code]])
+            self._next += 1
+        self.rows = self._next
+
+    def close(self) -> None:
+        """Дописывает оставшиеся строки (файлы, до чтения которых не дошло, - Unknown)"""
+        with self._lock:
+            self._flush(force=True)
+            self._file.close()
+
+    def category_counts(self):
+        import pandas as pd
+
+        return pd.Series(self.counts, index=pd.Index(self.labels, name='area_category'), name='count')
+
+
+def run_stream(rows: Iterator[Tuple[str, str]], output_folder: str, angles: List[float],
+               analysis: StreamAnalysis, workers: int = 4) -> Tuple[int, int]:
+    """
+    Один проход по аннотации: каждое изображение декодируется один раз,
+    его размеры идут в анализ, а массив - на поворот на все углы и запись.
+    Возвращает число успешно и неуспешно повернутых файлов.
+    """
+    from lab3_pipeline import RotationPipeline
+    from lab3_var4 import rotate_image, rotated_filename
+
+    output_path = Path(output_folder)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    def jobs():
+        for index, (absolute_path, relative_path) in enumerate(rows):
+            analysis.add(index, absolute_path, relative_path)
+            image_path = Path(absolute_path)
+            yield absolute_path, [(angle, str(output_path / rotated_filename(image_path, angle))) for angle in angles]
+
+    pipeline = RotationPipeline(rotate_image, workers=workers, on_decode=analysis.decoded)
+    try:
+        errors = pipeline.run(jobs())
+    finally:
+        analysis.close()
+
+    failed = 0
+    for error in errors:
+        if error is not None:
+            print(error)
+            failed += 1
+    return len(errors) - failed, failed
+
+
+def main():
+    from lab3_var4 import parse_angles, positive_int
+
+    parser = argparse.ArgumentParser(
+        description='Аннотация, поворот и анализ площадей изображений за один проход'
+    )
+    parser.add_argument('--csv', required=True,
+                        help='CSV аннотации: читается, а с --folder создается по ходу обработки')
+    parser.add_argument('--folder', default=None,
+                        help='Папка с изображениями; аннотация записывается в --csv')
+    parser.add_argument('-a', '--angles', default='45',
+                        help='Углы поворота: "15,30,45" или диапазон "0:360:15" (по умолчанию 45)')
+    parser.add_argument('-o', '--output', default='rotated_images',
+                        help='Папка для повернутых изображений')
+    parser.add_argument('--output_csv', default='analyzed_data.csv',
+                        help='Файл для строк анализа площадей')
+    parser.add_argument('--output_plot', default=None,
+                        help='Файл для гистограммы площадей (по умолчанию не строится)')
+    parser.add_argument('--bins', type=int, nargs='+', default=None,
+                        help='Границы категорий площади (по возрастанию)')
+    parser.add_argument('-w', '--workers', type=positive_int, default=4,
+                        help='Число потоков на каждую стадию (чтение, поворот, запись)')
+    parser.add_argument('--validate', action='store_true',
+                        help='Проверять файлы папки и отбрасывать дубликаты, как lab2_var4 '
+                             '(каждый файл декодируется для хэша еще раз; по умолчанию выключено)')
+    parser.add_argument('--max-distance', type=int, default=5,
+                        help='Расстояние хэшей, до которого изображения считаются почти одинаковыми '
+                             '(с --validate)')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        angles = parse_angles(args.angles)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.folder and not os.path.isdir(args.folder):
+        print(f"Ошибка: папка '{args.folder}' не найдена!")
+        return
+    if not args.folder and not os.path.isfile(args.csv):
+        print(f"Ошибка: файл аннотации '{args.csv}' не найден!")
+        return
+
+    with instrumented(args):
+        if args.folder:
+            rows = annotate_folder(args.folder, args.csv, args.validate, args.max_distance)
+        else:
+            rows = read_annotation(args.csv)
+        analysis = StreamAnalysis(args.output_csv, args.bins)
+        print(f"Обработка {args.folder or args.csv}: углы {', '.join(f'{angle:g}' for angle in angles)}...")
+        successful, failed = run_stream(rows, args.output, angles, analysis, workers=args.workers)
+
+        print(f"Повернуто файлов: {successful}, ошибок: {failed}")
+        if args.folder:
+            print(f"Аннотация сохранена в {args.csv}")
+        print(f"Анализ ({analysis.rows} записей) сохранен в {args.output_csv}")
+        counts = analysis.category_counts()
+        print("Статистика по категориям:")
+        for category, count in counts.items():
+            if count:
+                print(f"   {category}: {count} файлов")
+
+        if args.output_plot:
+            from lab4_var4 import plot_area_histogram, use_headless_backend
+
+            use_headless_backend()
+            with METRICS.stage('plot'):
+                plt = plot_area_histogram(None, counts)
+            with METRICS.stage('write') as timer:
+                plt.savefig(args.output_plot, dpi=300, bbox_inches='tight')
+                timer.bytes_written = os.path.getsize(args.output_plot)
+            print(f"График сохранен в {args.output_plot}")
+
+
+if __name__ == "__main__":
+    main()